@@ -0,0 +1,237 @@
+"""
+main.py / edit.py の各処理のベンチマーク。
+
+バーコードに似た合成画像をサイズとチャンネル数ごとに生成して各処理の時間を計測し、
+スループット（MP/s）とピークメモリを表示します。--json で結果をJSONに保存し、
+--compare で以前の結果と比較できます。
+
+    python benchmarks/bench_ops.py --json bench.json
+    python benchmarks/bench_ops.py --compare bench.json
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+from imgcore import core  # noqa: E402
+import edit as edit_py  # noqa: E402
+
+# (高さ, 幅) 300dpiのラベル、1200dpi相当、A4シート相当
+SIZES = {
+    'label': (100, 925),
+    'label4x': (400, 3700),
+    'sheet': (3508, 2480),
+}
+CHANNELS = (3, 4)
+
+
+def barcode_image(height, width, channels, seed=0):
+    # 白地に黒いバーが並ぶ合成画像
+    rng = np.random.default_rng(seed)
+    widths = rng.integers(1, 6, size=width)
+    bars = (np.cumsum(widths) // 3 % 2 * 255).astype(np.uint8)[:width]
+    image = np.empty((height, width, channels), dtype=np.uint8)
+    image[:, :, :3] = 255 - bars[None, :, None]
+    if channels == 4:
+        image[:, :, 3] = 255
+    return image
+
+
+def operations(workdir):
+    """
+    (処理名, 準備関数, 計測する関数) のリストを返す。
+
+    準備関数は入力画像を受け取り、計測する関数に渡す引数を返す。
+    """
+    def save_png(image):
+        path = os.path.join(workdir, 'src.png')
+        core.save_image(path, image)
+        return (path,)
+
+    def save_bmp(image):
+        path = os.path.join(workdir, 'src.bmp')
+        core.save_image(path, image)
+        return (path,)
+
+    def same(image):
+        return (image,)
+
+    def white(image):
+        return (255,) * image.shape[2]
+
+    out_png = os.path.join(workdir, 'out.png')
+    ops = [
+        ('read_image[png]', save_png, core.read_image),
+        ('read_image[bmp]', save_bmp, core.read_image),
+        ('save_image', same, lambda image: core.save_image(out_png, image)),
+        ('save_image[dpi]', same, lambda image: core.save_image(out_png, image, 300)),
+        ('dpi_change', save_png, lambda path: core.dpi_change(path, 300)),
+        ('rgba2rgb', same, core.rgba2rgb),
+        ('image_info', same, core.image_info),
+        ('resize_canvas', same, lambda image: core.resize_canvas(image, 10, 10, 10, 10, color=white(image))),
+        ('draw_border', same, lambda image: edit_py.draw_border(image, 25, 30, 50, 860, color=(0, 0, 0), thickness=2)),
+        ('draw_line', same, lambda image: edit_py.draw_line(image, (0, 0), (925, 100), color=(0, 0, 0), thickness=4)),
+        ('brightness_contrast', same, lambda image: edit_py.brightness_contrast(image, 1.5, 50)),
+        ('negative_image', same, edit_py.negative_image),
+        ('rotate_image[5]', same, lambda image: edit_py.rotate_image(image, 5)),
+        ('rotate_image[90]', same, lambda image: edit_py.rotate_image(image, 90, expand=False)),
+        ('shear_image_with_angle', same, lambda image: edit_py.shear_image_with_angle(image, 1.0)),
+        ('rotate_shear', same, lambda image: edit_py.rotate_shear(image, 5, 1.0)),
+    ]
+    for method in ('bicubic', 'bilinear', 'nearest'):
+        for scale in (300 / 96, 4.0):
+            ops.append((f'resize_image[{method},{scale:g}]', same,
+                        lambda image, method=method, scale=scale: core.resize_image(image, scale, method=method)))
+    return ops
+
+
+def measure(func, args, repeat, min_time):
+    # 1回あたりの実行時間のリスト（短い処理は min_time を超えるまで繰り返す）
+    func(*args)
+    times = []
+    for _ in range(repeat):
+        count = 0
+        start = time.perf_counter()
+        while True:
+            func(*args)
+            count += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        times.append(elapsed / count)
+    return times
+
+
+def measure_memory(func, args):
+    # tracemalloc で追跡したピークメモリと、実行後も残っているメモリ（バイト）
+    gc.collect()
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    result = func(*args)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak - base, current - base
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, channels, names, repeat, min_time):
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    results = []
+    try:
+        for size_name in sizes:
+            height, width = SIZES[size_name]
+            for ch in channels:
+                image = barcode_image(height, width, ch)
+                megapixels = height * width / 1e6
+                for name, prepare, func in operations(workdir):
+                    if names and not any(n in name for n in names):
+                        continue
+                    args = prepare(image)
+                    try:
+                        times = measure(func, args, repeat, min_time)
+                        peak, retained = measure_memory(func, args)
+                    except Exception as e:
+                        print(f'{name} {size_name} {ch}ch: {type(e).__name__}: {e}', file=sys.stderr)
+                        continue
+                    median = statistics.median(times)
+                    results.append({
+                        'op': name,
+                        'size': size_name,
+                        'shape': [height, width, ch],
+                        'median_s': median,
+                        'min_s': min(times),
+                        'mp_per_s': megapixels / median,
+                        'peak_bytes': peak,
+                        'retained_bytes': retained,
+                    })
+                    print_row(results[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def result_key(result):
+    return result['op'], result['size'], result['shape'][2]
+
+
+def print_row(result, baseline=None):
+    line = (f"{result['op']:<30} {result['size']:<8} {result['shape'][2]}ch "
+            f"{result['median_s'] * 1000:10.3f} ms {result['mp_per_s']:10.2f} MP/s "
+            f"{result['peak_bytes'] / 1e6:9.2f} MB")
+    if baseline is not None:
+        ratio = baseline['median_s'] / result['median_s']
+        line += f"  x{ratio:.2f} vs {baseline['median_s'] * 1000:.3f} ms"
+    print(line)
+
+
+def compare(results, baseline_path, threshold):
+    # 以前の結果と比較し、threshold 以上遅くなった処理の数を返す
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {result_key(r): r for r in json.load(f)['results']}
+    regressions = 0
+    print(f'\n--- compared with {baseline_path}')
+    for result in results:
+        base = baseline.get(result_key(result))
+        if base is None:
+            continue
+        print_row(result, base)
+        if result['median_s'] > base['median_s'] * (1 + threshold):
+            regressions += 1
+    print(f'{regressions} regression(s) slower than {threshold:.0%}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='main.py / edit.py の処理のベンチマーク')
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['label', 'label4x'])
+    parser.add_argument('--channels', nargs='+', type=int, choices=CHANNELS, default=list(CHANNELS))
+    parser.add_argument('--ops', nargs='+', default=None, help='処理名の一部で絞り込む')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.05, help='1回の計測の最小時間（秒）')
+    parser.add_argument('--json', help='結果を保存するJSONファイル')
+    parser.add_argument('--compare', help='比較する以前の結果（JSON）')
+    parser.add_argument('--threshold', type=float, default=0.1, help='遅くなったと判定する割合')
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.channels, args.ops, args.repeat, args.min_time)
+    if args.json:
+        import cv2
+        meta = {
+            'revision': git_revision(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+        }
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=1)
+    if args.compare:
+        if compare(results, args.compare, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+スクリプトの起動時の読み込み時間の計測。
+
+各スクリプトを新しいPythonのプロセスで import し、読み込みにかかった時間と、
+読み込み時に読み込まれてしまった重いライブラリ（cv2, skimage, PIL など）を表示します。
+読み込み時間が予算を超えるか、重いライブラリが読み込まれた場合は終了コード1で終了します。
+
+    python benchmarks/import_budget.py
+    python benchmarks/import_budget.py --budget 250 --json import.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 計測するモジュールと読み込み時間の予算（ms）。numpy の読み込み（100ms前後）を含む
+BUDGETS_MS = {
+    'main': 300,
+    'edit': 300,
+    'rgba2rgb': 300,
+    'convert': 300,
+    'imgcore.cli': 50,
+}
+# 処理で使うときまで読み込まないライブラリ
+HEAVY_MODULES = ('cv2', 'skimage', 'scipy', 'PIL', 'pandas', 'matplotlib', 'yaml')
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = sorted(m for m in {heavy!r} if m in sys.modules)
+print(json.dumps({{'seconds': elapsed, 'heavy': heavy}}))
+"""
+
+
+def measure(module, repeat):
+    # 新しいプロセスで repeat 回 import し、(読み込み時間のリスト, 読み込まれた重いライブラリ) を返す
+    times = []
+    heavy = set()
+    for _ in range(repeat):
+        code = _PROBE.format(module=module, heavy=HEAVY_MODULES)
+        out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        times.append(result['seconds'])
+        heavy.update(result['heavy'])
+    return times, sorted(heavy)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='スクリプトの読み込み時間の計測')
+    parser.add_argument('--modules', nargs='+', default=list(BUDGETS_MS), help='計測するモジュール')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=None, help='全てのモジュールに共通の予算（ms）')
+    parser.add_argument('--json', help='結果を保存するJSONファイル')
+    args = parser.parse_args()
+
+    results = []
+    over = 0
+    for module in args.modules:
+        times, heavy = measure(module, args.repeat)
+        median_ms = statistics.median(times) * 1000
+        budget = args.budget if args.budget is not None else BUDGETS_MS.get(module)
+        ok = not heavy and (budget is None or median_ms <= budget)
+        over += not ok
+        results.append({'module': module, 'median_ms': median_ms, 'min_ms': min(times) * 1000,
+                        'budget_ms': budget, 'heavy': heavy})
+        print(f"{module:<14} {median_ms:9.1f} ms (budget {budget if budget is not None else '-':>5}) "
+              f"{'OK  ' if ok else 'OVER'} {' '.join(heavy)}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'results': results}, f, indent=1)
+    print(f'{over} module(s) over budget')
+    if over:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
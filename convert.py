@@ -0,0 +1,49 @@
+import os
+import argparse
+from functools import partial
+from imgcore.writer import add_encoder_arguments, encoder_settings, convert_to_png
+from imgcore.scan import add_scan_arguments, scan_options, scan_files, prefetch
+from imgcore.batch import add_batch_arguments, run_files
+
+# 中間形式の拡張子
+INTERMEDIATE_EXTS = ('.npy', '.tif', '.tiff', '.bmp', '.qoi')
+
+def file_list(dir_path, exts, **options):
+    # ディレクトリ内の指定した拡張子のファイルを見つけた順に返す（拡張子の大文字・小文字は区別しない）
+    options['ignore_case'] = True
+    return prefetch(scan_files(dir_path, exts, **options))
+
+def process_file(f, dir_path, output_dir, dpi, options):
+    # 1ファイルをPNGに変換し、出力したファイルパスのリストを返す
+    print('Converting:', f)
+    output_path = os.path.join(output_dir, os.path.splitext(f)[0] + '.png')
+    convert_to_png(os.path.join(dir_path, f), output_path, dpi, options)
+    return [output_path]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='中間形式（npy / tiff / bmp / qoi）で保存した画像をPNGに変換します。')
+    parser.add_argument('input_dir', help='変換する画像のディレクトリ')
+    parser.add_argument('output_dir', help='PNGの出力先ディレクトリ')
+    parser.add_argument('--dpi', type=int, default=None, help='書き込むDPI（省略時は変換元のDPIを引き継ぐ。npy / qoi は保存時に記録した .dpi ファイルから）')
+    add_batch_arguments(parser)
+    add_scan_arguments(parser)
+    add_encoder_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        output_format, options = encoder_settings(args)
+    except ValueError as e:
+        parser.error(str(e))
+    if output_format not in (None, 'png'):
+        parser.error('変換先はPNGのみです')
+
+    files = file_list(args.input_dir, INTERMEDIATE_EXTS, **scan_options(args))
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    task = partial(process_file, dir_path=args.input_dir, output_dir=args.output_dir, dpi=args.dpi, options=options)
+    params = {'dpi': args.dpi, 'encoder': options}
+    return run_files(task, files, args.input_dir, args.output_dir, params, args)
+
+if __name__ == '__main__':
+    main()
@@ -1,89 +1,27 @@
 import os
-import cv2
-import re
-import math
+import argparse
+from functools import partial
 import numpy as np
-from skimage import io
-from PIL import Image, ImageDraw
-from PIL.Image import Resampling
-
-def file_list(dir_path, ext=None):
-    # ディレクトリ内のファイル一覧を取得
-    files = os.listdir(dir_path)
-    files = [f for f in files if os.path.isfile(os.path.join(dir_path, f))]
-    if ext is not None:
-        files = [f for f in files if os.path.splitext(f)[1] == ext]
-    return files
-
-def read_image(file_path):
-    # 画像を読み込む
-    image = io.imread(file_path)
-    return image
-
-def rgba2rgb(image_rgba):
-    # RGBA画像をRGBに変換
-    if image_rgba.shape[-1] == 4:
-        image_rgb = image_rgba[:, :, :3]
-    else:
-        image_rgb = image_rgba
-    return image_rgb
-
-def save_image(file_path, image):
-    # 画像を保存
-    io.imsave(file_path, image)
-
-def dpi_change(file_path, dpi):
-    # DPIを変更して保存
-    image = Image.open(file_path)
-    image.save(file_path, dpi=(dpi, dpi))
-
-def image_info(image):
-    return {
-        'shape': image.shape,
-        'dtype': image.dtype,
-        'min': image.min(),
-        'max': image.max()
-    }
-
-def rename_file(file_path, new_name):
-    # ファイル名を変更
-    os.rename(file_path, new_name)
-
-def bicubic_interpolation(image, scale):
-    height, width = image.shape[:2]
-    new_dimensions = (int(width * scale), int(height * scale))
-    return cv2.resize(image, new_dimensions, interpolation=cv2.INTER_CUBIC)
-
-def bilinear_interpolation(image, scale):
-    height, width = image.shape[:2]
-    new_dimensions = (int(width * scale), int(height * scale))
-    return cv2.resize(image, new_dimensions, interpolation=cv2.INTER_LINEAR)
-
-def nearest_interpolation(image, scale):
-    height, width = image.shape[:2]
-    new_dimensions = (int(width * scale), int(height * scale))
-    return cv2.resize(image, new_dimensions, interpolation=cv2.INTER_NEAREST)
-
-def resize_image(image, scale, method='bicubic'):
-    # 画像を拡大する
-    if method == 'bicubic':
-        return bicubic_interpolation(image, scale)
-    elif method == 'bilinear':
-        return bilinear_interpolation(image, scale)
-    elif method == 'nearest':
-        return nearest_interpolation(image, scale)
-    else:
-        raise ValueError('Invalid method')
-    
-def resize_canvas(image, tmargin, lmargin, bmargin, rmargin, color=(0, 0, 0, 0)):
-    # キャンバスをリサイズ
-    height, width, channels = image.shape
-    new_height = height + tmargin + bmargin
-    new_width = width + lmargin + rmargin
-    new_image = np.zeros((new_height, new_width, channels), dtype=image.dtype)
-    new_image[:, :] = color
-    new_image[tmargin:tmargin + height, lmargin:lmargin + width] = image
-    return new_image
+from imgcore.lazy import lazy_import
+from imgcore.writer import add_encoder_arguments, encoder_settings, FORMATS
+from imgcore.scan import add_scan_arguments, scan_options
+from imgcore.core import file_list, read_image, rgba2rgb, save_image, resize_image, resize_canvas
+from imgcore.batch import add_batch_arguments, run_files
+from imgcore.encoder import EncoderPool
+from imgcore.warp import rotate_expand, rotate_right_angle, rotate_shear, shear
+from imgcore.tone import apply_tone
+from imgcore.draw import draw
+from imgcore.pipeline import load_pipeline, compile_pipeline, run_pipeline, output_paths
+from imgcore.manifest import params_digest
+from imgcore.journal import Journal
+
+Image = lazy_import('PIL.Image')
+
+def save_and_record(file_path, image, dpi=None, options=None, journal=None, key=None):
+    # 画像を保存し、保存を終えたことをジャーナルに記録する
+    save_image(file_path, image, dpi, options)
+    if journal is not None:
+        journal.record(key, file_path)
 
 def draw_border(image, top, left, height, width, color=(0, 0, 0, 0), thickness=1):
     """
@@ -99,36 +37,27 @@ def draw_border(image, top, left, height, width, color=(0, 0, 0, 0), thickness=1
     :return: 画像にボーダーが描画されたImageオブジェクト
     """
 
-    image = Image.fromarray(image)
-
-    draw = ImageDraw.Draw(image)
-    
-    # 上辺
-    draw.rectangle([left, top, left + width, top + thickness], fill=color)
-    # 下辺
-    draw.rectangle([left, top + height - thickness, left + width, top + height], fill=color)
-    # 左辺
-    draw.rectangle([left, top, left + thickness, top + height], fill=color)
-    # 右辺
-    draw.rectangle([left + width - thickness, top, left + width, top + height], fill=color)
-    return np.array(image)
+    # パイプラインでは入力画像を他の操作と共有するため、コピーに描画する
+    return draw(image, [('border', {'top': top, 'left': left, 'height': height, 'width': width,
+                                    'color': color, 'thickness': thickness})], copy=True)
 
 def brightness_contrast(image, alpha, beta):
-    # 明るさとコントラストを調整
+    # 明るさとコントラストを調整（uint8はLUTで1パスで変換）
+    if image.dtype == np.uint8:
+        return apply_tone(image, [('brightness_contrast', {'alpha': alpha, 'beta': beta})])
     new_image = np.clip(alpha * image + beta, 0, 255).astype(np.uint8)
     return new_image
 
 def negative_image(image):
-    # ネガティブ画像を作成
+    # ネガティブ画像を作成（uint8はLUTで1パスで変換）
+    if image.dtype == np.uint8:
+        return apply_tone(image, [('negative', {})])
     new_image = 255 - image
     return new_image
 
 def draw_line(image, start, end, color=(0, 0, 0, 0), thickness=1):
-    # 直線を描画
-    image = Image.fromarray(image)
-    draw = ImageDraw.Draw(image)
-    draw.line(start + end, fill=color, width=thickness)
-    return np.array(image)
+    # 直線を描画（入力画像は書き換えない）
+    return draw(image, [('line', {'start': start, 'end': end, 'color': color, 'thickness': thickness})], copy=True)
 
 def rotate_image(image, angle, expand=True):
     """
@@ -140,30 +69,18 @@ def rotate_image(image, angle, expand=True):
     :return: 回転後の画像
     """
 
-    image = Image.fromarray(image)
-
     if expand:
-        # 元の画像サイズ
-        w, h = image.size
-        
-        # 角度をラジアンに変換
-        angle_rad = math.radians(angle)
-        
-        # 回転後の画像サイズを計算
-        new_w = abs(w * math.cos(angle_rad)) + abs(h * math.sin(angle_rad))
-        new_h = abs(h * math.cos(angle_rad)) + abs(w * math.sin(angle_rad))
-        
-        # 新しいサイズのキャンバスを作成
-        new_image = Image.new("RGB", (int(math.ceil(new_w)), int(math.ceil(new_h))), (255, 255, 255))
-        
-        # 元の画像をキャンバスの中心に貼り付ける
-        new_image.paste(image, ((new_image.size[0] - w) // 2, (new_image.size[1] - h) // 2))
-        
-        # 新しいキャンバス上で回転
-        return np.array(new_image.rotate(angle, resample=Resampling.BICUBIC, expand=False))
+        # 白いキャンバスの中央に貼り付けて回転する処理を1回の変換で行う（変換は画像サイズ・角度ごとにキャッシュ）
+        return rotate_expand(image, angle)
     else:
-        # キャンバスのリサイズなしで回転する
-        return np.array(image.rotate(angle, resample=Resampling.BICUBIC, expand=True))
+        # キャンバスのリサイズなしで回転する。90度単位の部分は補間せずに配列のビューとして回転し、
+        # 残りの角度（-45度から45度）だけを補間する
+        quarter_turns = round(angle / 90)
+        residual = angle - 90 * quarter_turns
+        image = rotate_right_angle(image, 90 * quarter_turns)
+        if residual == 0:
+            return image
+        return np.array(Image.fromarray(image).rotate(residual, resample=Image.Resampling.BICUBIC, expand=True))
 
 def shear_image_with_angle(image, angle_degrees, direction='horizontal', shear_direction='right'):
     """
@@ -175,160 +92,74 @@ def shear_image_with_angle(image, angle_degrees, direction='horizontal', shear_d
     :return: シアー変換されたPIL.Imageオブジェクト
     """
 
-    image = Image.fromarray(image)
-
-    # シアー角度のタンジェントを計算
-    shear_factor = math.tan(math.radians(angle_degrees))
-
-    if shear_direction == 'left':
-        shear_factor = -shear_factor
-    
-    width, height = image.size
-    
-    if direction == 'horizontal':
-        # 水平方向のシアー
-        xshift = abs(shear_factor) * height
-        new_width = width + int(math.ceil(xshift))
-        
-        # アフィン変換行列
-        matrix = (1, shear_factor, -xshift if shear_factor > 0 else 0, 0, 1, 0)
-        # 変換
-        image = image.transform((new_width, height), Image.Transform.AFFINE, matrix, resample=Resampling.BICUBIC)
-    
-    elif direction == 'vertical':
-        # 垂直方向のシアー
-        yshift = abs(shear_factor) * width
-        new_height = height + int(math.ceil(yshift))
-        
-        # アフィン変換行列
-        matrix = (1, 0, 0, shear_factor, 1, -yshift if shear_factor > 0 else 0)
-        # 変換
-        image = image.transform((width, new_height), Image.Transform.AFFINE, matrix, resample=Resampling.BICUBIC)
-    
-    else:
-        raise ValueError("Invalid direction: choose 'horizontal' or 'vertical'")
-    
-    return np.array(image)
+    # 変換行列・出力サイズ・黒く塗る領域は画像サイズと角度ごとにキャッシュされる
+    return shear(image, angle_degrees, direction, shear_direction)
+
+# パイプライン定義から呼び出せる操作
+OPS = {
+    'draw_border': draw_border,
+    'brightness_contrast': brightness_contrast,
+    'negative_image': negative_image,
+    'tone': apply_tone,
+    'resize_image': resize_image,
+    'draw_line': draw_line,
+    'rotate_image': rotate_image,
+    'shear_image_with_angle': shear_image_with_angle,
+    'rotate_shear': rotate_shear,
+    'resize_canvas': resize_canvas,
+    'rgba2rgb': rgba2rgb,
+}
+
+def process_file(f, dir_path, output_dir, pipeline, encoders=0, output_ext=None, options=None, journal=None):
+    # 1ファイル分の処理を行い、出力したファイルパスのリストを返す
+    print('Processing:', f)
+    # 前回中断したときに保存済みだったバリエーションは作り直さない
+    done = journal.completed(f) if journal is not None else set()
+    if done and all(p in done for p in output_paths(pipeline, f, output_dir, output_ext)):
+        print('Done')
+        return output_paths(pipeline, f, output_dir, output_ext)
+    file_path = os.path.join(dir_path, f)
+    image = read_image(file_path)
+    # エンコードはバックグラウンドで行い、次のバリエーションの計算と並行させる
+    save = partial(save_and_record, options=options, journal=journal, key=f)
+    with EncoderPool(encoders, save=save) as pool:
+        outputs = run_pipeline(pipeline, OPS, image, f, output_dir, pool.submit, output_ext, done)
+    print('Done')
+    return outputs
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='画像を編集したバリエーションを保存します。')
+    parser.add_argument('--pipeline', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pipelines', 'edit.json'),
+                        help='パイプライン定義ファイル（JSONまたはYAML）')
+    add_batch_arguments(parser)
+    add_scan_arguments(parser)
+    add_encoder_arguments(parser)
+    args = parser.parse_args(argv)
 
-def main():
-    dpi = 300  # DPIを指定
     ext = '.png'  # 対象の拡張子を指定
+    spec = load_pipeline(args.pipeline)
+    pipeline = compile_pipeline(spec, OPS)
+    # 出力形式はパイプライン定義の encoder より引数の指定を優先する
+    try:
+        output_format, options = encoder_settings(args, spec.get('encoder'))
+    except ValueError as e:
+        parser.error(str(e))
+    output_ext = FORMATS[output_format] if output_format is not None else None
 
     # ファイル一覧を取得
     dir_path = 'edit_input'
-    files = file_list(dir_path, ext)
+    files = file_list(dir_path, ext, **scan_options(args))
 
     output_dir = 'edit_output'
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    for f in files:
-        print('Processing:', f)
-        file_path = os.path.join(dir_path, f)
-        output_path = os.path.join(output_dir, f)
-        image = read_image(file_path)
-        # 枠線を描画
-        image_border = draw_border(image, 25, 30, 50, 860, color=(0, 0, 0), thickness=2)
-        save_image(output_path, image_border)
-        new_name = os.path.splitext(output_path)[0] + f'_border{ext}'
-        rename_file(output_path, new_name)
-        # 太い枠線を描画
-        image_border_thick = draw_border(image, 20, 30, 60, 860, color=(0, 0, 0), thickness=6)
-        save_image(output_path, image_border_thick)
-        new_name = os.path.splitext(output_path)[0] + f'_border_thick{ext}'
-        rename_file(output_path, new_name)
-        # 明るいコントラストへ変換
-        image_bc = brightness_contrast(image, 1.5, 50)
-        save_image(output_path, image_bc)
-        new_name = os.path.splitext(output_path)[0] + f'_bright{ext}'
-        rename_file(output_path, new_name)
-        # もっと明るいコントラストへ変換
-        image_bc = brightness_contrast(image, 2.0, 100)
-        save_image(output_path, image_bc)
-        new_name = os.path.splitext(output_path)[0] + f'_more_bright{ext}'
-        rename_file(output_path, new_name)
-        # 暗いコントラストへ変換
-        image_bc = brightness_contrast(image, 0.5, -50)
-        save_image(output_path, image_bc)
-        new_name = os.path.splitext(output_path)[0] + f'_dark{ext}'
-        rename_file(output_path, new_name)
-        # もっと暗いコントラストへ変換
-        image_bc = brightness_contrast(image, 0.5, -100)
-        save_image(output_path, image_bc)
-        new_name = os.path.splitext(output_path)[0] + f'_more_dark{ext}'
-        rename_file(output_path, new_name)
-        # ネガティブ画像を作成
-        image_negative = negative_image(image)
-        save_image(output_path, image_negative)
-        new_name = os.path.splitext(output_path)[0] + f'_negative{ext}'
-        rename_file(output_path, new_name)
-        # 高解像度に変換
-        image_resize = resize_image(image, 1200/dpi, method='nearest')
-        save_image(output_path, image_resize)
-        dpi_change(output_path, 1200)
-        new_name = re.sub(r'_\d{3}dpi', '_1200dpi', output_path)
-        rename_file(output_path, new_name)
-        # 低解像度に変換
-        image_resize = resize_image(image, 72/dpi, method='bicubic')
-        save_image(output_path, image_resize)
-        dpi_change(output_path, 72)
-        new_name = re.sub(r'_\d{3}dpi', '_72dpi', output_path)
-        rename_file(output_path, new_name)
-        # ラインを描画
-        image_line = draw_line(image, (50, 50), (870, 50), color=(0, 0, 0), thickness=2)
-        save_image(output_path, image_line)
-        new_name = os.path.splitext(output_path)[0] + f'_line{ext}'
-        rename_file(output_path, new_name)
-        # スラッシュを描画
-        image_line = draw_line(image, (0, 0), (925, 100), color=(0, 0, 0), thickness=4)
-        save_image(output_path, image_line)
-        new_name = os.path.splitext(output_path)[0] + f'_slash{ext}'
-        rename_file(output_path, new_name)
-        # 90度系回転
-        for angle in [90, 180, 270]:
-            image_rotate = rotate_image(image, angle, expand=False)
-            save_image(output_path, image_rotate)
-            new_name = os.path.splitext(output_path)[0] + f'_rotate{angle}{ext}'
-            rename_file(output_path, new_name)
-
-        # 1-10度の回転
-        for angle in range(1, 11):
-            image_rotate = rotate_image(image, angle)
-            save_image(output_path, image_rotate)
-            new_name = os.path.splitext(output_path)[0] + f'_rotate{angle}{ext}'
-            rename_file(output_path, new_name)
-
-        # 0.1, 0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 1.75, 2.0度のシアー変換 (right)
-        for angle in [0.1, 0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 1.75, 2.0]:
-            image_shear = shear_image_with_angle(image, angle, direction='horizontal', shear_direction='right')
-            save_image(output_path, image_shear)
-            new_name = os.path.splitext(output_path)[0] + f'_shear{angle}_horizontal_right{ext}'
-            rename_file(output_path, new_name)
-
-        # 0.1, 0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 1.75, 2.0度のシアー変換 (left)
-        for angle in [0.1, 0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 1.75, 2.0]:
-            image_shear = shear_image_with_angle(image, angle, direction='horizontal', shear_direction='left')
-            save_image(output_path, image_shear)
-            new_name = os.path.splitext(output_path)[0] + f'_shear{angle}_horizontal_left{ext}'
-            rename_file(output_path, new_name)
-
-        # rotate and shear
-        angles = range(1, 11)
-        shear_angles = [0.1, 0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 1.75, 2.0]
-
-        for angle in angles:
-            for shear_angle in shear_angles:
-                image_rotate = rotate_image(image, angle)
-                image_shear = shear_image_with_angle(image_rotate, shear_angle, direction='horizontal', shear_direction='right')
-                save_image(output_path, image_shear)
-                new_name = os.path.splitext(output_path)[0] + f'_rotate{angle}_shear{shear_angle}_horizontal_right{ext}'
-                rename_file(output_path, new_name)
-                image_shear = shear_image_with_angle(image_rotate, shear_angle, direction='horizontal', shear_direction='left')
-                save_image(output_path, image_shear)
-                new_name = os.path.splitext(output_path)[0] + f'_rotate{angle}_shear{shear_angle}_horizontal_left{ext}'
-                rename_file(output_path, new_name)
-
-        print('Done')
+    params = {'pipeline': spec, 'output_ext': output_ext, 'encoder': options}
+    # 保存を終えたバリエーションを記録し、中断した場合は次回その続きから処理する
+    journal = Journal.for_output_dir(output_dir, params_digest(params))
+    task = partial(process_file, dir_path=dir_path, output_dir=output_dir, pipeline=pipeline,
+                   encoders=args.encoders, output_ext=output_ext, options=options, journal=journal)
+    return run_files(task, files, dir_path, output_dir, params, args, journal=journal)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,3 @@
+"""
+main.py / edit.py / rgba2rgb.py から共通で利用する画像処理モジュール群。
+"""
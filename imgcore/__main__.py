@@ -0,0 +1,4 @@
+import sys
+from imgcore.cli import main
+
+sys.exit(main())
@@ -0,0 +1,119 @@
+import numpy as np
+from imgcore.lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+
+# RGBA画像をRGBに変換する。
+# アルファが全て不透明な場合はアルファを除いた連続したRGBの配列を1回のコピーで作り、
+# 半透明の画素がある場合は背景色に整数演算で合成する（アルファを捨てるだけだと透明部分の色が残るため）。
+# 末尾の軸がチャンネルであれば N×H×W×C にまとめた画像にも使える。
+
+WHITE = (255, 255, 255)
+DEFAULT_CHUNK_ROWS = 256
+
+
+def add_alpha_arguments(parser):
+    # アルファの合成のコマンドライン引数を追加
+    parser.add_argument('--background', default='255,255,255', metavar='R,G,B',
+                        help='半透明の画素を合成する背景色（none の場合は合成せずアルファを捨てる）')
+    return parser
+
+
+def parse_background(text):
+    """
+    '255,255,255' のような文字列を背景色のタプルにします。'none' の場合はNoneを返します。
+    """
+    if text is None or text.lower() == 'none':
+        return None
+    color = tuple(int(v) for v in text.split(','))
+    if len(color) != 3:
+        raise ValueError(f'Invalid background color: {text}')
+    return color
+
+
+def _maxval(dtype):
+    return np.iinfo(dtype).max if dtype.kind in 'ui' else 1.0
+
+
+def _row_chunks(image, chunk_rows):
+    # 先頭の軸（N×H×W×C の場合は N×H）を chunk_rows 行ずつに分ける
+    rows = image.reshape((-1,) + image.shape[-2:]) if image.ndim > 3 else image
+    for y in range(0, rows.shape[0], chunk_rows):
+        yield rows[y:y + chunk_rows]
+
+
+def is_opaque(image, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    アルファチャンネルが全て不透明かどうかを返します。アルファがない画像はTrueです。
+
+    短冊ごとに調べ、不透明でない画素が見つかった時点で終了します。
+    """
+    if image.ndim < 3 or image.shape[-1] != 4:
+        return True
+    maxval = _maxval(image.dtype)
+    for chunk in _row_chunks(image, chunk_rows):
+        if chunk[..., 3].min() < maxval:
+            return False
+    return True
+
+
+def strip_alpha(image):
+    # アルファを除いたRGBを連続した配列として返す（コピーは1回）
+    if image.ndim == 3 and image.dtype in (np.uint8, np.uint16, np.float32):
+        return cv2.cvtColor(np.ascontiguousarray(image), cv2.COLOR_RGBA2RGB)
+    return np.ascontiguousarray(image[..., :3])
+
+
+def _blend(rgb, alpha, background, maxval, out):
+    # out = (rgb * a + bg * (max - a)) / max を四捨五入した整数で求める
+    wide = np.uint32 if maxval > 255 else np.uint16
+    a = alpha.astype(wide)[..., None]
+    blended = rgb.astype(wide) * a
+    blended += (maxval - a) * np.array(background, dtype=wide)
+    if maxval == 255:
+        # 255での除算を (x + 128 + ((x + 128) >> 8)) >> 8 で行う（0-65025の範囲で正確）
+        blended += 128
+        blended += blended >> 8
+        blended >>= 8
+        out[...] = blended
+    else:
+        out[...] = (blended.astype(np.uint64) + maxval // 2) // maxval
+
+
+def composite(image, background=WHITE, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    RGBA画像を背景色に合成したRGB画像を返します。
+
+    :param image: uint8 / uint16 / 浮動小数点（値域0-1）の H×W×4 または N×H×W×4 の画像
+    :param background: 背景色（8bitの値。uint16の画像では65535/255倍、浮動小数点では1/255倍する）
+    """
+    maxval = _maxval(image.dtype)
+    out = np.empty(image.shape[:-1] + (3,), dtype=image.dtype)
+    if image.dtype.kind == 'f':
+        bg = np.array(background, dtype=image.dtype) / 255
+        a = image[..., 3:4]
+        np.add(image[..., :3] * a, bg * (1 - a), out=out)
+        return out
+    bg = tuple(int(round(v * maxval / 255)) for v in background)
+    out_rows = out.reshape((-1,) + out.shape[-2:]) if out.ndim > 3 else out
+    for i, chunk in enumerate(_row_chunks(image, chunk_rows)):
+        y = i * chunk_rows
+        _blend(chunk[..., :3], chunk[..., 3], bg, maxval, out_rows[y:y + chunk.shape[0]])
+    return out
+
+
+def to_rgb(image, background=WHITE):
+    """
+    画像をRGBに変換します。
+
+    - RGB / グレースケールの画像はそのまま返します。
+    - アルファが全て不透明な場合、または background がNoneの場合はアルファを除きます。
+    - それ以外は background に合成します。
+
+    戻り値は常にC連続の配列です（RGBの入力がビューの場合も連続した配列にします）。
+    """
+    if image.ndim < 3 or image.shape[-1] != 4:
+        return np.ascontiguousarray(image)
+    if background is None or is_opaque(image):
+        return strip_alpha(image)
+    return composite(image, background)
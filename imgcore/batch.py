@@ -0,0 +1,281 @@
+import os
+import sys
+import traceback
+from collections import deque
+from concurrent.futures import BrokenExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from imgcore.manifest import Manifest, params_digest
+from imgcore.writer import remove_stale_temporaries
+from imgcore import instrument
+
+BACKENDS = ('thread', 'process')
+# マニフェストを保存する間隔（処理したファイル数）
+MANIFEST_SAVE_INTERVAL = 100
+
+
+def add_batch_arguments(parser):
+    # バッチ実行用のコマンドライン引数を追加
+    parser.add_argument('--workers', type=int, default=1,
+                        help='並列数（0の場合はCPU数、1の場合は逐次実行）')
+    parser.add_argument('--backend', choices=BACKENDS, default='thread',
+                        help='並列実行のバックエンド')
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help='同時に投入する最大ファイル数（省略時は並列数の2倍）')
+    parser.add_argument('--encoders', type=int, default=2,
+                        help='1ファイルの出力をバックグラウンドでエンコードするスレッド数（0で同期的に保存）')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='同じサイズの画像をまとめて処理する最大枚数（対応するスクリプトのみ。1で1枚ずつ）')
+    parser.add_argument('--force', action='store_true',
+                        help='前回から変更のない入力も含めて全て処理し直す')
+    parser.add_argument('--profile', action='store_true',
+                        help='処理の段階ごとの時間・入出力バイト数・メモリを計測して最後に表示する')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='計測結果をChromeのトレース形式（JSON）で保存する（--profileを含む）')
+    return parser
+
+
+def _call(func, item):
+    # 1ファイル分の処理を実行し、例外は結果として返す
+    try:
+        return func(item), None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}\n{traceback.format_exc()}'
+
+
+def cpu_count():
+    # 利用可能なCPU数（コンテナのCPU制限を考慮）
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _make_executor(backend, workers):
+    if backend == 'thread':
+        return ThreadPoolExecutor(max_workers=workers)
+    elif backend == 'process':
+        # multiprocessing の読み込みは使う場合だけにする
+        from concurrent.futures import ProcessPoolExecutor
+        return ProcessPoolExecutor(max_workers=workers)
+    else:
+        raise ValueError(f'Invalid backend: {backend}')
+
+
+def run_batch(func, items, workers=1, backend='thread', max_pending=None):
+    """
+    items の各要素に func を適用し、完了した順に (item, result, error) を返すジェネレータ。
+
+    投入中の処理数を max_pending 件に制限するため、items がジェネレータでも
+    一度に全件を読み込まず、メモリ使用量は一定に保たれます。
+    1件の失敗は error に文字列として返し、残りの処理は継続します。
+    ワーカープロセスが異常終了した場合はワーカーを作り直し、そのとき実行中だった項目を1件ずつ
+    実行し直して、原因の項目だけを失敗として返します。
+
+    :param func: 1件分の処理を行う関数（processの場合はpickle可能であること）
+    :param items: 処理対象のイテラブル
+    :param workers: 並列数（0の場合はCPU数、1の場合は逐次実行）
+    :param backend: 'thread' または 'process'
+    :param max_pending: 同時に投入する最大件数（省略時は並列数の2倍）
+    """
+    if workers == 0:
+        workers = cpu_count()
+    if workers <= 1:
+        for item in items:
+            result, error = _call(func, item)
+            yield item, result, error
+        return
+
+    if max_pending is None:
+        max_pending = workers * 2
+    max_pending = max(max_pending, workers)
+
+    executor = _make_executor(backend, workers)
+    pending = {}
+    # ワーカープロセスが異常終了したときに実行中だった項目。どの項目が原因か分からないため、
+    # 作り直したワーカーで1件ずつ実行し、もう一度異常終了した項目だけを失敗とする
+    suspects = deque()
+    retrying = False
+    iterator = iter(items)
+    exhausted = False
+    try:
+        while pending or suspects or not exhausted:
+            broken = False
+            if retrying:
+                pass
+            elif suspects:
+                item = suspects.popleft()
+                retrying = True
+                try:
+                    pending[executor.submit(_call, func, item)] = item
+                except BrokenExecutor:
+                    suspects.appendleft(item)
+                    broken = True
+            else:
+                while not exhausted and len(pending) < max_pending:
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    try:
+                        pending[executor.submit(_call, func, item)] = item
+                    except BrokenExecutor:
+                        # 実行中の別の項目でワーカーが異常終了していた（この項目は実行されていない）
+                        suspects.append(item)
+                        broken = True
+                        break
+            if pending and not broken:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    try:
+                        result, error = future.result()
+                    except BrokenExecutor as e:
+                        broken = True
+                        if retrying:
+                            # 1件だけ実行していたので、この項目が原因
+                            yield item, None, f'{type(e).__name__}: {e}'
+                        else:
+                            suspects.append(item)
+                        continue
+                    except Exception as e:
+                        result, error = None, f'{type(e).__name__}: {e}'
+                    yield item, result, error
+                retrying = retrying and bool(pending)
+            if broken:
+                # 異常終了の前に終わっていた項目は結果を返し、残りは1件ずつ実行し直す
+                for future, item in pending.items():
+                    if future.done() and not isinstance(future.exception(), BrokenExecutor):
+                        try:
+                            result, error = future.result()
+                        except Exception as e:
+                            result, error = None, f'{type(e).__name__}: {e}'
+                        yield item, result, error
+                    else:
+                        suspects.append(item)
+                pending.clear()
+                retrying = False
+                executor.shutdown(wait=True)
+                executor = _make_executor(backend, workers)
+    finally:
+        executor.shutdown(wait=True)
+
+
+def report_errors(errors):
+    # 失敗したファイルを標準エラーに出力
+    for item, error in errors:
+        print('Failed:', item, file=sys.stderr)
+        print(error, file=sys.stderr)
+    if errors:
+        print(f'{len(errors)} file(s) failed', file=sys.stderr)
+
+
+def _chunks(items, size):
+    # size 個ずつのタプルに分ける
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield tuple(chunk)
+            chunk = []
+    if chunk:
+        yield tuple(chunk)
+
+
+def run_files(task, files, dir_path, output_dir, params, args, batch_task=None, journal=None):
+    """
+    ディレクトリ内のファイルを run_batch で処理し、失敗したファイルを表示します。
+
+    出力先のマニフェストに入力ファイルと処理パラメータのハッシュ値を記録し、
+    前回から入力もパラメータも変わっておらず出力が揃っているファイルは処理を省略します。
+    前回中断した処理が残した書きかけの一時ファイルは、出力先のディレクトリごとに最初に削除します。
+
+    :param task: ファイル名を受け取り、出力したファイルパスのリストを返す関数
+    :param files: 処理対象のファイル名のイテラブル
+    :param dir_path: 入力ディレクトリ
+    :param output_dir: 出力ディレクトリ（マニフェストの保存先）
+    :param params: 出力に影響する処理パラメータ（JSONに変換できる値）
+    :param args: add_batch_arguments で追加した引数の解析結果
+    :param batch_task: --batch-size が2以上の場合に task の代わりに使う関数。
+        ファイル名のタプルを受け取り、ファイル名から出力したファイルパスのリストへの辞書を返す。
+        失敗した場合はまとめた全てのファイルが失敗として扱われる
+    :param journal: task が保存を終えた出力を記録する imgcore.journal.Journal。
+        各ファイルの処理を始める前に入力の状態を渡し、全ての出力を終えたファイルの記録は最後に削除する。
+        失敗・中断したファイルの記録は残り、次回はそのファイルの残りの出力から再開できる
+    :return: 失敗した (ファイル名, エラー) のリスト
+    """
+    manifest = Manifest.for_output_dir(output_dir)
+    params_hash = params_digest(params)
+    states = {}
+    skipped = 0
+    swept = set()
+
+    def sweep(path):
+        if path not in swept and os.path.isdir(path):
+            swept.add(path)
+            remove_stale_temporaries(path)
+
+    def pending():
+        nonlocal skipped
+        for f in files:
+            try:
+                state = manifest.input_state(f, os.path.join(dir_path, f))
+            except OSError:
+                state = None
+            if state is not None and not args.force and manifest.is_up_to_date(f, state, params_hash):
+                skipped += 1
+                continue
+            states[f] = state
+            if journal is not None and state is not None:
+                journal.begin(f, state, reset=args.force)
+            # サブディレクトリの入力は出力にも同じディレクトリを作る
+            subdir = os.path.dirname(f)
+            if subdir:
+                os.makedirs(os.path.join(output_dir, subdir), exist_ok=True)
+            sweep(os.path.join(output_dir, subdir))
+            yield f
+
+    batched = batch_task is not None and args.batch_size > 1
+    items = _chunks(pending(), args.batch_size) if batched else pending()
+    if batched:
+        task = batch_task
+    profile = args.profile or args.trace
+    if profile:
+        task = instrument.Instrumented(task)
+    events = []
+
+    def results():
+        # まとめて処理した結果をファイルごとに分ける
+        for item, result, error in run_batch(task, items, args.workers, args.backend, args.max_pending):
+            if profile and error is None:
+                result, item_events = result
+                events.extend(item_events)
+            if not batched:
+                yield item, result, error
+                continue
+            for f in item:
+                yield f, None if error is not None else result[f], error
+
+    errors = []
+    completed = []
+    for f, outputs, error in results():
+        state = states.pop(f)
+        if error is not None:
+            errors.append((f, error))
+            continue
+        if state is not None:
+            manifest.record(f, state, params_hash, outputs)
+            completed.append(f)
+        if manifest.dirty >= MANIFEST_SAVE_INTERVAL:
+            manifest.save()
+    manifest.save()
+    if journal is not None:
+        # マニフェストに記録したファイルはジャーナルの記録が不要になる
+        journal.discard(completed)
+
+    if skipped:
+        print(f'Skipped {skipped} up-to-date file(s)')
+    if profile:
+        print(instrument.summary(events))
+    if args.trace:
+        instrument.export_chrome_trace(events, args.trace)
+    report_errors(errors)
+    return errors
@@ -0,0 +1,97 @@
+import numpy as np
+from imgcore.tone import apply_tone
+from imgcore.resize import nearest_indices
+from imgcore import stats
+from imgcore.alpha import WHITE, to_rgb
+from imgcore.lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+
+# 同じサイズの画像を N×H×W×C の1つの配列にまとめて処理する。
+# 小さな画像を1枚ずつ処理すると関数呼び出しと配列確保のオーバーヘッドが処理時間の大半を占めるため、
+# 同じ形状の画像をまとめて1回の演算で処理する。各関数は main.py / edit.py の同名の関数を
+# 1枚ずつ適用した場合と同じ結果を返す。
+
+DEFAULT_BATCH_SIZE = 64
+
+
+def _stack(group):
+    items = [item for item, _ in group]
+    return items, np.stack([image for _, image in group])
+
+
+def group_by_shape(items, read, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    入力を読み込み、形状とデータ型が同じ画像を最大 batch_size 枚ずつまとめて返すジェネレータ。
+
+    まとめきれなかった画像は最後に形状ごとに返します。入力の順序は形状ごとには保たれます。
+
+    :param items: 入力（ファイル名など）のイテラブル
+    :param read: 入力から画像を読み込む関数 read(item)
+    :param batch_size: 1つのまとまりの最大枚数
+    :return: (入力のリスト, N×H×W(×C) の配列) を返すジェネレータ
+    """
+    groups = {}
+    for item in items:
+        image = read(item)
+        key = (image.shape, image.dtype.str)
+        group = groups.setdefault(key, [])
+        group.append((item, image))
+        if len(group) >= batch_size:
+            del groups[key]
+            yield _stack(group)
+    for group in groups.values():
+        yield _stack(group)
+
+
+def _rows(stack):
+    # N×H×W×C を (N×H)×W×C として扱う（cv2は3次元までしか受け付けない）
+    return np.ascontiguousarray(stack).reshape((-1,) + stack.shape[2:])
+
+
+def rgba2rgb(stack, background=WHITE):
+    # RGBA画像をRGBに変換（全て不透明ならアルファを除いて1回でコピーし、それ以外は背景色に合成する）
+    return to_rgb(stack, background)
+
+
+def resize_canvas(stack, tmargin, lmargin, bmargin, rmargin, color=(0, 0, 0, 0)):
+    # 全ての画像に同じ余白を追加する
+    n, height, width, channels = stack.shape
+    new_stack = np.empty((n, height + tmargin + bmargin, width + lmargin + rmargin, channels), dtype=stack.dtype)
+    new_stack[:] = color[:channels]
+    new_stack[:, tmargin:tmargin + height, lmargin:lmargin + width] = stack
+    return new_stack
+
+
+def resize_nearest(stack, scale):
+    """
+    resize_image(image, scale, method='nearest') を全ての画像に適用します。
+
+    列方向の補間は全ての画像の行をつなげた1回の cv2.resize で行い、行方向は選んだ行を複製します。
+    """
+    n, height, width = stack.shape[:3]
+    new_width, new_height = int(width * scale), int(height * scale)
+    resized = cv2.resize(_rows(stack), (new_width, n * height), interpolation=cv2.INTER_NEAREST)
+    # 各画像で選ぶ行の番号を、つなげた行の番号に変換して1回で取り出す
+    rows = (np.arange(n)[:, None] * height + nearest_indices(height, new_height)).ravel()
+    return resized.take(rows, axis=0).reshape((n, new_height, new_width) + stack.shape[3:])
+
+
+def brightness_contrast(stack, alpha, beta):
+    # 明るさとコントラストを調整（uint8は全ての画像に1回のLUTで変換）
+    if stack.dtype == np.uint8:
+        steps = [('brightness_contrast', {'alpha': alpha, 'beta': beta})]
+        return apply_tone(_rows(stack), steps).reshape(stack.shape)
+    return np.clip(alpha * stack + beta, 0, 255).astype(np.uint8)
+
+
+def negative_image(stack):
+    # ネガティブ画像を作成
+    if stack.dtype == np.uint8:
+        return apply_tone(_rows(stack), [('negative', {})]).reshape(stack.shape)
+    return 255 - stack
+
+
+def image_info(stack):
+    # 画像ごとの image_info のリスト（min / max は参照された画像だけ走査する）
+    return [stats.image_info(image) for image in stack]
@@ -0,0 +1,108 @@
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+from contextlib import redirect_stdout
+
+# 複数の小さなジョブを1つのプロセスで順に実行する。
+# スクリプトを1回ずつ起動すると、ジョブごとにPythonの起動とライブラリの読み込みの時間がかかるため、
+# 読み込んだモジュールと変換プランなどのキャッシュを全てのジョブで使い回す。
+#
+#   python -m imgcore jobs.jsonl
+#   producer | python -m imgcore -
+#
+# ジョブは1行1件のJSONで、次のキーを持つ。
+#
+# - script: 実行するスクリプト（main, edit, rgba2rgb, convert）
+# - args: スクリプトに渡すコマンドライン引数のリスト（省略時は引数なし）
+# - cwd: 実行するディレクトリ（スクリプトの入出力のディレクトリはここからの相対パス）
+# - id: 結果に含める任意の値
+#
+# ジョブが終わるたびに結果を1行1件のJSONで標準出力に書き出す。スクリプトの表示は標準エラーに出す。
+
+SCRIPTS = ('main', 'edit', 'rgba2rgb', 'convert')
+# スクリプトのあるディレクトリ
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_script(name):
+    # スクリプトをモジュールとして読み込む（2回目以降は読み込み済みのモジュールを返す）
+    if name not in SCRIPTS:
+        raise ValueError(f'Unknown script: {name}')
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return importlib.import_module(name)
+
+
+def run_job(job, log=None):
+    """
+    1件のジョブを実行し、結果の辞書を返します。
+
+    status は ok（全て成功）、failed（一部のファイルが失敗）、error（ジョブ自体が失敗）のいずれかです。
+    作業ディレクトリはジョブの実行後に元に戻します。
+
+    :param job: ジョブの辞書（script, args, cwd, id）
+    :param log: スクリプトの表示の出力先（省略時は標準エラー）
+    """
+    start = time.perf_counter()
+    result = {'id': job.get('id'), 'script': job.get('script')}
+    cwd = os.getcwd()
+    try:
+        module = load_script(job.get('script'))
+        if job.get('cwd'):
+            os.chdir(job['cwd'])
+        with redirect_stdout(log or sys.stderr):
+            errors = module.main([str(a) for a in job.get('args', [])])
+        result['status'] = 'failed' if errors else 'ok'
+        result['failed_files'] = [f for f, _ in errors or ()]
+    except SystemExit as e:
+        # 引数の誤りなど（argparse は SystemExit を送出する）
+        result['status'] = 'error'
+        result['error'] = f'exit status {e.code}'
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = f'{type(e).__name__}: {e}'
+    finally:
+        os.chdir(cwd)
+    result['seconds'] = round(time.perf_counter() - start, 6)
+    return result
+
+
+def read_jobs(lines):
+    # 1行1件のJSONのジョブを順に返す（空行は無視し、読めない行はエラーの結果にする）
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+        except ValueError as e:
+            job = {'error': f'line {number}: {e}'}
+        if not isinstance(job, dict):
+            job = {'error': f'line {number}: not a JSON object'}
+        yield job
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m imgcore',
+                                     description='複数のジョブ（main.py / edit.py / rgba2rgb.py / convert.py の実行）を'
+                                                 '1つのプロセスで順に実行します。')
+    parser.add_argument('jobs', nargs='?', default='-', help='ジョブの一覧（JSON Lines）。- の場合は標準入力から読む')
+    args = parser.parse_args(argv)
+
+    failed = 0
+    jobs_file = sys.stdin if args.jobs == '-' else open(args.jobs, encoding='utf-8')
+    try:
+        for job in read_jobs(jobs_file):
+            if 'error' in job:
+                result = {'id': None, 'script': None, 'status': 'error', 'error': job['error'], 'seconds': 0.0}
+            else:
+                result = run_job(job)
+            print(json.dumps(result, ensure_ascii=False), flush=True)
+            failed += result['status'] != 'ok'
+    finally:
+        if jobs_file is not sys.stdin:
+            jobs_file.close()
+    return 1 if failed else 0
@@ -0,0 +1,112 @@
+import os
+import numpy as np
+from imgcore.lazy import lazy_import
+from imgcore.instrument import stage
+from imgcore.writer import write_image, set_dpi
+from imgcore.resize import resize_nearest
+from imgcore import stats
+from imgcore.scan import scan_files, prefetch
+from imgcore.alpha import WHITE, to_rgb
+
+cv2 = lazy_import('cv2')
+io = lazy_import('skimage.io')
+Image = lazy_import('PIL.Image')
+
+# main.py / edit.py / rgba2rgb.py で共通の処理。
+# cv2・skimage・PIL は実際に使う処理を呼び出したときに読み込む（imgcore.lazy）。
+
+# PILで読み込んだ配列が skimage.io.imread と同じになるモード。
+# これ以外（パレットなど）は skimage で読み込む
+_PIL_READ_MODES = ('1', 'L', 'LA', 'RGB', 'RGBA', 'I;16')
+
+
+def file_list(dir_path, ext=None, **options):
+    # ディレクトリ内のファイルを見つけた順に返す（探索はバックグラウンドで行い、見つけたファイルから処理を始める）
+    return prefetch(scan_files(dir_path, ext, **options))
+
+
+def decode_image(file_path):
+    # 画像を読み込む（read_image と同じだが計測しない。呼び出し側で stage を記録する場合に使う）
+    # よくある形式はPILだけで読み込み、skimage（と scipy）の読み込みを省く
+    try:
+        with Image.open(file_path) as image:
+            if image.mode in _PIL_READ_MODES and getattr(image, 'n_frames', 1) == 1:
+                return np.array(image)
+    except Image.UnidentifiedImageError:
+        pass
+    return io.imread(file_path)
+
+
+def read_image(file_path):
+    # 画像を読み込む
+    with stage('decode') as event:
+        image = decode_image(file_path)
+        event['bytes_read'] = os.path.getsize(file_path)
+    return image
+
+
+def rgba2rgb(image_rgba, background=WHITE):
+    # RGBA画像をRGBに変換（半透明の画素は背景色に合成する。background=Noneの場合はアルファを捨てる）
+    return to_rgb(image_rgba, background)
+
+
+def save_image(file_path, image, dpi=None, options=None):
+    # 画像を保存（DPIの指定があれば同時に書き込む。形式は拡張子で決まる）
+    write_image(file_path, image, dpi, options)
+
+
+def dpi_change(file_path, dpi):
+    # DPIを変更して保存（PNGは画素をデコードせずpHYsチャンクのみ書き換える）
+    set_dpi(file_path, dpi)
+
+
+def image_info(image):
+    # shape, dtype, min, max の辞書（min / max は参照されたときに1回の走査で求める）
+    return stats.image_info(image)
+
+
+def rename_file(file_path, new_name):
+    # ファイル名を変更
+    os.rename(file_path, new_name)
+
+
+def bicubic_interpolation(image, scale):
+    height, width = image.shape[:2]
+    new_dimensions = (int(width * scale), int(height * scale))
+    return cv2.resize(image, new_dimensions, interpolation=cv2.INTER_CUBIC)
+
+
+def bilinear_interpolation(image, scale):
+    height, width = image.shape[:2]
+    new_dimensions = (int(width * scale), int(height * scale))
+    return cv2.resize(image, new_dimensions, interpolation=cv2.INTER_LINEAR)
+
+
+def nearest_interpolation(image, scale):
+    height, width = image.shape[:2]
+    new_dimensions = (int(width * scale), int(height * scale))
+    # cv2.INTER_NEAREST と同じ結果を、列方向の補間と行の複製に分けて求める
+    return resize_nearest(image, *new_dimensions)
+
+
+def resize_image(image, scale, method='bicubic'):
+    # 画像を拡大する
+    if method == 'bicubic':
+        return bicubic_interpolation(image, scale)
+    elif method == 'bilinear':
+        return bilinear_interpolation(image, scale)
+    elif method == 'nearest':
+        return nearest_interpolation(image, scale)
+    else:
+        raise ValueError('Invalid method')
+
+
+def resize_canvas(image, tmargin, lmargin, bmargin, rmargin, color=(0, 0, 0, 0)):
+    # キャンバスをリサイズ
+    height, width, channels = image.shape
+    new_height = height + tmargin + bmargin
+    new_width = width + lmargin + rmargin
+    new_image = np.zeros((new_height, new_width, channels), dtype=image.dtype)
+    new_image[:, :] = color
+    new_image[tmargin:tmargin + height, lmargin:lmargin + width] = image
+    return new_image
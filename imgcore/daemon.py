@@ -0,0 +1,412 @@
+import argparse
+import itertools
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import BrokenExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from imgcore.batch import BACKENDS, cpu_count
+from imgcore.cli import ROOT, load_script
+from imgcore.pipeline import load_pipeline, compile_pipeline
+from imgcore.writer import FORMATS, encoder_settings
+
+# 常駐してジョブを受け付けるデーモン。
+# ワーカー（スレッドまたはプロセス）は起動時にライブラリを読み込み、変換プランなどのキャッシュを
+# ジョブをまたいで保持するため、スクリプトを1回ずつ起動する場合の起動・読み込み・キャッシュの作り直しが不要になる。
+#
+#   python -m imgcore.daemon --port 8765
+#   python -m imgcore.daemon --socket /tmp/imgcore.sock
+#
+# API（JSON）
+#
+# - POST /jobs: ジョブを投入する。202 と {"id", "url"} を返す。処理待ちのファイルが多すぎる場合は 429
+# - GET /jobs/<id>: ジョブの進捗。?wait=秒 を付けると完了するか指定した秒数が経つまで待つ
+# - GET /jobs: ジョブの一覧
+# - GET /status: ワーカー数・処理待ちのファイル数
+#
+# ジョブは次のキーを持つ。
+#
+# - inputs: 入力ファイルのパスのリスト（相対パスはデーモンの作業ディレクトリから）
+# - output_dir: 出力先ディレクトリ
+# - pipeline: パイプライン定義（edit.py の --pipeline と同じ形式）またはそのファイルのパス。
+#   省略時は pipelines/edit.json。操作は edit.py の OPS（resize_canvas, rgba2rgb, resize_image,
+#   rotate_image など）
+# - encoder: 出力形式とPNGのエンコード設定（パイプライン定義の encoder より優先）
+
+DEFAULT_PORT = 8765
+DEFAULT_PIPELINE = os.path.join(ROOT, 'pipelines', 'edit.json')
+# 保持する完了したジョブの数（古いものから破棄する）
+KEEP_JOBS = 1000
+# GET /jobs/<id>?wait= で待つ最大秒数
+MAX_WAIT = 60.0
+
+
+class Busy(Exception):
+    # 処理待ちのファイルが上限に達している
+    pass
+
+
+class Unavailable(Exception):
+    # ワーカーのプールを作り直してもジョブを投入できない
+    pass
+
+
+def _warm_up():
+    # ワーカーの起動時に、ジョブの処理で使うライブラリを読み込んでおく
+    load_script('edit')
+    for name in ('cv2', 'PIL.Image', 'PIL.PngImagePlugin'):
+        __import__(name)
+
+
+def _process_input(file_path, output_dir, pipeline, output_ext, options, encoders):
+    # 1ファイルにパイプラインを適用し、出力したファイルパスのリストを返す（ワーカーで実行する）
+    edit = load_script('edit')
+    dir_path, f = os.path.split(file_path)
+    return edit.process_file(f, dir_path, output_dir, pipeline, encoders=encoders, output_ext=output_ext,
+                             options=options)
+
+
+class Job:
+    """
+    投入されたジョブと、ファイルごとの処理の進捗。
+    """
+
+    def __init__(self, job_id, inputs, output_dir, client_id=None):
+        self.id = job_id
+        self.client_id = client_id
+        self.inputs = inputs
+        self.output_dir = output_dir
+        self.futures = {}
+        # ワーカーに渡したファイル数
+        self.total = 0
+        self.outputs = {}
+        self.errors = {}
+        self.created = time.time()
+        self.finished = None
+
+    @property
+    def completed(self):
+        return len(self.outputs) + len(self.errors)
+
+    def state(self):
+        if self.completed == self.total:
+            return 'failed' if self.errors else 'done'
+        if self.completed or any(future.running() for future in self.futures.values()):
+            return 'running'
+        return 'queued'
+
+    def summary(self):
+        return {
+            'id': self.id,
+            'client_id': self.client_id,
+            'state': self.state(),
+            'total': self.total,
+            'done': len(self.outputs),
+            'failed': len(self.errors),
+            'created': self.created,
+            'finished': self.finished,
+        }
+
+    def to_dict(self):
+        result = self.summary()
+        result['output_dir'] = self.output_dir
+        result['outputs'] = self.outputs
+        result['errors'] = self.errors
+        return result
+
+
+class Daemon:
+    """
+    ワーカーのプールとジョブの状態を管理します。
+
+    投入されたジョブはファイルごとにワーカーへ渡します。処理待ち（実行中を含む）のファイル数が
+    max_pending を超えるジョブは受け付けず Busy を送出するため、投入側は待ってから再投入します
+    （処理待ちのファイルがない場合は、max_pending より多いジョブも受け付けます）。
+
+    :param workers: ワーカー数（0の場合はCPU数）
+    :param backend: 'thread' または 'process'
+    :param max_pending: 処理待ちのファイル数の上限（省略時はワーカー数の8倍）
+    :param encoders: 1ファイルの出力をバックグラウンドでエンコードするスレッド数
+    """
+
+    def __init__(self, workers=0, backend='process', max_pending=None, encoders=2):
+        self.workers = workers or cpu_count()
+        self.backend = backend
+        self.max_pending = max_pending or self.workers * 8
+        self.encoders = encoders
+        self.pending = 0
+        self.jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._pipelines = {}
+        _warm_up()
+        self.ops = load_script('edit').OPS
+        self._executor = self._make_executor()
+
+    def _make_executor(self):
+        if self.backend == 'thread':
+            return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='worker')
+        elif self.backend == 'process':
+            from concurrent.futures import ProcessPoolExecutor
+            return ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_up)
+        else:
+            raise ValueError(f'Invalid backend: {self.backend}')
+
+    def _replace_executor(self, executor):
+        # ワーカープロセスが異常終了して使えなくなったプールを作り直す（self._lock を保持して呼ぶ）。
+        # 同じプールの複数のファイルから呼ばれるため、作り直し済みの場合は何もしない
+        if self._executor is executor:
+            executor.shutdown(wait=False)
+            self._executor = self._make_executor()
+
+    def _pipeline(self, spec):
+        # パイプライン定義をコンパイルする（同じ定義はコンパイル済みのものを使う）
+        if spec is None:
+            spec = DEFAULT_PIPELINE
+        if isinstance(spec, str):
+            spec = load_pipeline(spec)
+        if not isinstance(spec, dict) or not isinstance(spec.get('nodes'), list):
+            raise ValueError('pipeline must be an object with a list of nodes, or a path to one')
+        if not isinstance(spec.get('encoder', {}), dict):
+            raise ValueError('pipeline encoder must be an object')
+        key = json.dumps(spec, sort_keys=True)
+        pipeline = self._pipelines.get(key)
+        if pipeline is None:
+            pipeline = self._pipelines[key] = (compile_pipeline(spec, self.ops), spec.get('encoder'))
+        return pipeline
+
+    def submit(self, request):
+        """
+        ジョブを投入し、Job を返します。
+
+        :raises ValueError: ジョブの指定が正しくない場合
+        :raises Busy: 処理待ちのファイル数が上限に達している場合
+        :raises Unavailable: ワーカーのプールを作り直してもジョブを投入できない場合
+        """
+        inputs = request.get('inputs')
+        if not isinstance(inputs, list) or not inputs or not all(isinstance(p, str) for p in inputs):
+            raise ValueError('inputs must be a non-empty list of file paths')
+        # 出力ファイル名は入力ファイル名から決まるため、同じファイル名の入力は出力を上書きし合う
+        names = [os.path.basename(p) for p in inputs]
+        if len(set(names)) != len(names):
+            duplicates = sorted({name for name in names if names.count(name) > 1})
+            raise ValueError(f'inputs must have distinct file names: {", ".join(duplicates)}')
+        output_dir = request.get('output_dir')
+        if not isinstance(output_dir, str):
+            raise ValueError('output_dir is required')
+        if not isinstance(request.get('encoder', {}), dict):
+            raise ValueError('encoder must be an object')
+        pipeline, encoder = self._pipeline(request.get('pipeline'))
+        output_format, options = encoder_settings(None, dict(encoder or {}, **request.get('encoder', {})))
+        output_ext = FORMATS[output_format] if output_format is not None else None
+        os.makedirs(output_dir, exist_ok=True)
+
+        with self._lock:
+            if self.pending and self.pending + len(inputs) > self.max_pending:
+                raise Busy(f'{self.pending} file(s) pending')
+            # 以前のジョブでワーカーが異常終了していた場合は、プールを作り直して投入し直す
+            for _ in range(2):
+                executor = self._executor
+                try:
+                    futures = {file_path: executor.submit(_process_input, file_path, output_dir, pipeline,
+                                                          output_ext, options, self.encoders)
+                               for file_path in inputs}
+                    break
+                except BrokenExecutor:
+                    self._replace_executor(executor)
+            else:
+                raise Unavailable('worker pool is unavailable')
+            job = Job(next(self._ids), inputs, output_dir, request.get('id'))
+            job.futures = futures
+            job.total = len(futures)
+            self.pending += job.total
+            self.jobs[job.id] = job
+            self._forget_old_jobs()
+        for file_path, future in futures.items():
+            future.add_done_callback(lambda future, job=job, file_path=file_path, executor=executor:
+                                     self._done(job, file_path, future, executor))
+        return job
+
+    def _done(self, job, file_path, future, executor):
+        # 1ファイルの処理が終わったときにワーカーの完了通知から呼ばれる
+        broken = False
+        try:
+            outputs, error = future.result(), None
+        except BrokenExecutor as e:
+            # ワーカーが異常終了した。実行中・処理待ちのファイルは失敗とし、次のジョブのためにプールを作り直す
+            outputs, error = None, f'{type(e).__name__}: {e}'
+            broken = True
+        except Exception as e:
+            outputs, error = None, f'{type(e).__name__}: {e}'
+        with self._changed:
+            if broken:
+                self._replace_executor(executor)
+            if error is None:
+                job.outputs[file_path] = outputs
+            else:
+                job.errors[file_path] = error
+            self.pending -= 1
+            if job.completed == job.total:
+                job.finished = time.time()
+                job.futures.clear()
+            self._changed.notify_all()
+
+    def _forget_old_jobs(self):
+        # 完了したジョブが KEEP_JOBS を超えたら古いものから破棄する
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished is not None]
+        for job_id in finished[:max(len(finished) - KEEP_JOBS, 0)]:
+            del self.jobs[job_id]
+
+    def job(self, job_id, wait=0.0):
+        """
+        ジョブの状態の辞書を返します。存在しない場合はNoneを返します。
+
+        :param wait: ジョブが完了していない場合に、完了を待つ最大秒数
+        """
+        deadline = time.monotonic() + min(wait, MAX_WAIT)
+        with self._changed:
+            job = self.jobs.get(job_id)
+            while job is not None and job.finished is None and time.monotonic() < deadline:
+                self._changed.wait(deadline - time.monotonic())
+            return job.to_dict() if job is not None else None
+
+    def status(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'backend': self.backend,
+                'pending': self.pending,
+                'max_pending': self.max_pending,
+                'jobs': len(self.jobs),
+            }
+
+    def list_jobs(self):
+        with self._lock:
+            return [job.summary() for job in self.jobs.values()]
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = 'imgcore'
+
+    def _send(self, status, body, headers=()):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        daemon = self.server.daemon
+        if parts == ['status']:
+            return self._send(200, daemon.status())
+        if parts == ['jobs']:
+            return self._send(200, daemon.list_jobs())
+        if len(parts) == 2 and parts[0] == 'jobs' and parts[1].isdigit():
+            try:
+                wait = float(parse_qs(url.query).get('wait', ['0'])[0])
+            except ValueError:
+                return self._send(400, {'error': 'wait must be a number'})
+            job = daemon.job(int(parts[1]), wait)
+            if job is None:
+                return self._send(404, {'error': 'job not found'})
+            return self._send(200, job)
+        self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if urlsplit(self.path).path.rstrip('/') != '/jobs':
+            return self._send(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError('job must be a JSON object')
+            job = self.server.daemon.submit(request)
+        except Busy as e:
+            return self._send(429, {'error': str(e)}, [('Retry-After', '1')])
+        except Unavailable as e:
+            return self._send(503, {'error': str(e)}, [('Retry-After', '1')])
+        except (ValueError, TypeError, KeyError, OSError) as e:
+            # TypeError: パイプライン定義のノードの値の型が正しくない場合など
+            return self._send(400, {'error': f'{type(e).__name__}: {e}'})
+        except Exception as e:
+            self.log_error('%s', traceback.format_exc())
+            return self._send(500, {'error': f'{type(e).__name__}: {e}'})
+        self._send(202, {'id': job.id, 'url': f'/jobs/{job.id}'})
+
+    def address_string(self):
+        # Unixソケットの場合は接続元のアドレスがない
+        return self.client_address[0] if self.client_address else 'unix'
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # Unixソケットで HTTP を受け付けるサーバー
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def make_server(daemon, host='127.0.0.1', port=DEFAULT_PORT, socket_path=None):
+    # localhost の HTTP または Unix ソケットのサーバーを作る
+    if socket_path is not None:
+        server = UnixHTTPServer(socket_path, Handler)
+    else:
+        server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon = daemon
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m imgcore.daemon',
+                                     description='ワーカーを起動したまま、ローカルのHTTPまたはUnixソケットでジョブを受け付けます。')
+    parser.add_argument('--host', default='127.0.0.1', help='待ち受けるアドレス')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='待ち受けるポート')
+    parser.add_argument('--socket', default=None, metavar='PATH', help='HTTPの代わりにUnixソケットで待ち受ける')
+    parser.add_argument('--workers', type=int, default=0, help='ワーカー数（0の場合はCPU数）')
+    parser.add_argument('--backend', choices=BACKENDS, default='process', help='ワーカーの種類')
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help='処理待ちのファイル数の上限（超えるジョブは429で拒否する。省略時はワーカー数の8倍）')
+    parser.add_argument('--encoders', type=int, default=2,
+                        help='1ファイルの出力をバックグラウンドでエンコードするスレッド数（0で同期的に保存）')
+    args = parser.parse_args(argv)
+
+    daemon = Daemon(args.workers, args.backend, args.max_pending, args.encoders)
+    server = make_server(daemon, args.host, args.port, args.socket)
+    # SIGTERM でも処理中のファイルを終えてから終了する
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    where = args.socket or f'http://{args.host}:{server.server_port}'
+    print(f'Listening on {where} ({daemon.workers} {args.backend} worker(s))', file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+import numpy as np
+from imgcore.lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+Image = lazy_import('PIL.Image')
+ImageDraw = lazy_import('PIL.ImageDraw')
+
+# numpy配列に直接図形を描画する。座標はPIL.ImageDrawと同じく両端を含む画素座標で、
+# 軸に平行な矩形・直線はスライスへの代入で、それ以外の直線は線の外接矩形の範囲だけで描画するため、
+# 描画のコストは画像全体ではなく描画する範囲の大きさに比例する。
+# 色の解釈と描画される画素はPILで描画した場合と同じになる（antialias=True の直線を除く）。
+
+
+def ink(image, color):
+    """
+    色を画像のチャンネル数に合わせます（PILと同じく、足りないアルファは不透明、余分な値は無視）。
+    """
+    if np.isscalar(color):
+        color = (color,)
+    color = tuple(color)
+    if image.ndim == 2:
+        if len(color) >= 3:
+            # PILと同じ輝度の式でグレースケールに変換
+            return (color[0] * 299 + color[1] * 587 + color[2] * 114) // 1000
+        return color[0]
+    channels = image.shape[2]
+    if len(color) < channels:
+        color = color + (np.iinfo(image.dtype).max if image.dtype.kind in 'ui' else 1.0,) * (channels - len(color))
+    return color[:channels]
+
+
+def fill_rect(image, x0, y0, x1, y1, color):
+    """
+    (x0, y0)-(x1, y1)（両端を含む）の矩形を塗りつぶします。画像の外側は切り捨てます。
+    """
+    height, width = image.shape[:2]
+    x0, y0 = max(int(x0), 0), max(int(y0), 0)
+    x1, y1 = min(int(x1) + 1, width), min(int(y1) + 1, height)
+    if x0 < x1 and y0 < y1:
+        image[y0:y1, x0:x1] = ink(image, color)
+    return image
+
+
+def border(image, top, left, height, width, color, thickness=1):
+    """
+    edit.py の draw_border と同じ4本の辺を描画します。
+    """
+    fill_rect(image, left, top, left + width, top + thickness, color)
+    fill_rect(image, left, top + height - thickness, left + width, top + height, color)
+    fill_rect(image, left, top, left + thickness, top + height, color)
+    fill_rect(image, left + width - thickness, top, left + width, top + height, color)
+    return image
+
+
+def line(image, start, end, color, thickness=1, antialias=False):
+    """
+    start から end まで直線を描画します。
+
+    :param thickness: 線の太さ（PILの width と同じ）
+    :param antialias: Trueの場合は cv2.LINE_AA でアンチエイリアスをかける（太さはOpenCVの解釈になる）
+    """
+    (x0, y0), (x1, y1) = start, end
+    if antialias:
+        if not image.flags.c_contiguous:
+            raise ValueError('Anti-aliased lines need a C-contiguous image')
+        cv2.line(image, (int(x0), int(y0)), (int(x1), int(y1)), ink(image, color), max(int(thickness), 1), cv2.LINE_AA)
+        return image
+
+    if y0 == y1 or x0 == x1:
+        # PILの太い水平線・垂直線は中心から (太さ-1)//2 だけ上（左）から始まる
+        offset = (thickness - 1) // 2 if thickness > 1 else 0
+        extent = max(thickness, 1) - 1
+        if y0 == y1:
+            return fill_rect(image, min(x0, x1), y0 - offset, max(x0, x1), y0 - offset + extent, color)
+        return fill_rect(image, x0 - offset, min(y0, y1), x0 - offset + extent, max(y0, y1), color)
+
+    # 斜めの直線はPILで外接矩形の範囲だけ1チャンネルのマスクに描画する
+    height, width = image.shape[:2]
+    pad = thickness + 1
+    bx0, by0 = max(min(x0, x1) - pad, 0), max(min(y0, y1) - pad, 0)
+    bx1, by1 = min(max(x0, x1) + pad + 1, width), min(max(y0, y1) + pad + 1, height)
+    if bx0 >= bx1 or by0 >= by1:
+        return image
+    mask = Image.new('L', (bx1 - bx0, by1 - by0), 0)
+    ImageDraw.Draw(mask).line((x0 - bx0, y0 - by0, x1 - bx0, y1 - by0), fill=255, width=thickness)
+    region = image[by0:by1, bx0:bx1]
+    region[np.asarray(mask) != 0] = ink(image, color)
+    return image
+
+
+PRIMITIVES = {
+    'rect': fill_rect,
+    'border': border,
+    'line': line,
+}
+
+
+def draw(image, primitives, copy=False):
+    """
+    複数の図形をまとめて描画します。
+
+    :param image: 描画先の画像（numpy配列）
+    :param primitives: (図形名, パラメータの辞書) のリスト。図形名は PRIMITIVES のキー
+    :param copy: Trueの場合は入力画像を書き換えず、コピーに描画する
+    :return: 描画後の画像
+    """
+    if copy:
+        image = image.copy()
+    for name, params in primitives:
+        PRIMITIVES[name](image, **params)
+    return image
@@ -0,0 +1,70 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from imgcore import instrument
+from imgcore.writer import write_image
+
+
+class EncoderPool:
+    """
+    出力画像のエンコードとファイル書き込みをバックグラウンドのスレッドで行う。
+
+    submit は画像をキューに入れてすぐに戻るため、次のバリエーションの計算と
+    前のバリエーションの圧縮が並行して進みます（zlibの圧縮中はGILが解放される）。
+    キューに入れられる画像は max_pending 枚までで、それを超えると空きができるまで待つため、
+    メモリ使用量は一定に保たれます。
+
+    with文で使用し、終了時に全ての書き込みの完了を待ちます。書き込みに失敗した場合は
+    終了時に最初の例外を送出します。
+
+    :param workers: エンコードを行うスレッド数（0の場合は submit の中で同期的に保存する）
+    :param max_pending: キューに入れられる最大枚数（省略時はスレッド数の2倍）
+    :param save: 保存関数 save(file_path, image, dpi)
+    """
+
+    def __init__(self, workers=2, max_pending=None, save=write_image):
+        self.workers = workers
+        self.save = save
+        self._errors = []
+        self._executor = None
+        if workers > 0:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='encoder')
+            self._slots = threading.BoundedSemaphore(max_pending or workers * 2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(raise_errors=exc_type is None)
+
+    def _run(self, recorder, file_path, image, dpi):
+        try:
+            with instrument.recording(recorder=recorder) if recorder is not None else nullcontext():
+                self.save(file_path, image, dpi)
+        except Exception as e:
+            self._errors.append(e)
+        finally:
+            self._slots.release()
+
+    def submit(self, file_path, image, dpi=None):
+        """
+        画像の保存を依頼します。呼び出し後に image を書き換えないでください。
+        """
+        if self._executor is None:
+            self.save(file_path, image, dpi)
+            return
+        self._slots.acquire()
+        try:
+            self._executor.submit(self._run, instrument.current_recorder(), file_path, image, dpi)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def close(self, raise_errors=True):
+        # 全ての書き込みの完了を待つ
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if raise_errors and self._errors:
+            raise self._errors[0]
+
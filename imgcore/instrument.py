@@ -0,0 +1,173 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 処理の段階（デコード、余白追加、リサイズ、エンコードなど）ごとの時間・入出力バイト数・メモリを記録する。
+# 記録はスレッドごとに有効にした Recorder に対してのみ行い、無効な場合はほとんどコストがかからない。
+
+_local = threading.local()
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss():
+    # 現在の常駐メモリ（バイト）。取得できない場合はNone
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def max_rss():
+    # プロセス開始からの最大常駐メモリ（バイト）
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Recorder:
+    # 1ファイル分の処理の記録
+    def __init__(self, file=None):
+        self.file = file
+        self.events = []
+
+
+def current_recorder():
+    # このスレッドで有効な Recorder（無効な場合はNone）
+    return getattr(_local, 'recorder', None)
+
+
+@contextmanager
+def recording(file=None, recorder=None):
+    """
+    このスレッドで stage の記録を有効にします。
+
+    別のスレッドに処理を渡す場合は、current_recorder() で取得した Recorder を
+    recorder に指定すると同じ記録に追加されます。
+
+    :param file: 記録に付けるファイル名
+    :param recorder: 記録先（省略時は新しく作成する）
+    :return: Recorder（events に記録が追加される）
+    """
+    previous = getattr(_local, 'recorder', None)
+    if recorder is None:
+        recorder = Recorder(file)
+    _local.recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _local.recorder = previous
+
+
+@contextmanager
+def stage(name):
+    """
+    処理の段階を計測します。記録が有効でない場合は何もしません。
+
+    with文で受け取った辞書に bytes_read / bytes_written を設定すると記録に含まれます。
+
+        with stage('decode') as event:
+            event['bytes_read'] = os.path.getsize(file_path)
+    """
+    recorder = getattr(_local, 'recorder', None)
+    event = {}
+    if recorder is None:
+        yield event
+        return
+    start = time.perf_counter()
+    try:
+        yield event
+    finally:
+        event.update({
+            'name': name,
+            'file': recorder.file,
+            'start': start,
+            'dur': time.perf_counter() - start,
+            'rss': current_rss(),
+            'max_rss': max_rss(),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+        })
+        recorder.events.append(event)
+
+
+class Instrumented:
+    """
+    1ファイル分の処理関数を包み、処理全体と各段階の記録を結果と一緒に返す。
+
+    プロセス並列でも使えるよう、記録はpickle可能な辞書のリストで返す。
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, item):
+        with recording(str(item)) as recorder:
+            with stage('total'):
+                result = self.func(item)
+        return result, recorder.events
+
+
+def _mb(value):
+    return f'{value / 1e6:10.2f}' if value else f'{"-":>10}'
+
+
+def summary(events, top=5):
+    """
+    段階ごとの集計表と、処理時間の長いファイルを文字列で返します。
+    """
+    stages = {}
+    for event in events:
+        s = stages.setdefault(event['name'], {'count': 0, 'time': 0.0, 'read': 0, 'written': 0, 'max_rss': 0})
+        s['count'] += 1
+        s['time'] += event['dur']
+        s['read'] += event.get('bytes_read', 0)
+        s['written'] += event.get('bytes_written', 0)
+        s['max_rss'] = max(s['max_rss'], event.get('max_rss') or 0)
+    total = stages.get('total', {}).get('time') or sum(s['time'] for s in stages.values()) or 1.0
+
+    lines = [f'{"stage":<24} {"count":>7} {"total s":>10} {"mean ms":>10} {"share":>7} '
+             f'{"read MB":>10} {"write MB":>10} {"peak RSS MB":>12}']
+    for name, s in sorted(stages.items(), key=lambda item: -item[1]['time']):
+        share = '' if name == 'total' else f'{s["time"] / total:7.1%}'
+        lines.append(f'{name:<24} {s["count"]:>7} {s["time"]:>10.3f} {s["time"] / s["count"] * 1000:>10.3f} '
+                     f'{share:>7} {_mb(s["read"])} {_mb(s["written"])} {_mb(s["max_rss"]):>12}')
+
+    files = sorted((e for e in events if e['name'] == 'total'), key=lambda e: -e['dur'])[:top]
+    if files:
+        lines.append('')
+        lines.append('slowest files:')
+        for event in files:
+            lines.append(f'  {event["dur"] * 1000:10.1f} ms  {event["file"]}')
+    return '\n'.join(lines)
+
+
+def export_chrome_trace(events, path):
+    """
+    記録をChromeのトレース形式（chrome://tracing、Perfetto）のJSONで保存します。
+    """
+    if not events:
+        return
+    origin = min(e['start'] for e in events)
+    trace = []
+    for event in events:
+        args = {k: event[k] for k in ('file', 'bytes_read', 'bytes_written', 'rss', 'max_rss') if event.get(k) is not None}
+        trace.append({
+            'name': event['name'],
+            'cat': 'stage',
+            'ph': 'X',
+            'ts': (event['start'] - origin) * 1e6,
+            'dur': event['dur'] * 1e6,
+            'pid': event['pid'],
+            'tid': event['tid'],
+            'args': args,
+        })
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+
+# 1つの入力から複数の出力（バリエーション）を作る処理で、保存を終えた (入力, 出力) の組を記録する。
+# 途中で中断した処理を再開したときに、保存済みの出力を作り直さずに残りから続けるために使う。
+# 入力ごとの処理が全て終わったかどうかはマニフェスト（imgcore.manifest）に記録する。
+
+JOURNAL_NAME = '.journal.jsonl'
+
+
+class Journal:
+    """
+    保存を終えた出力を1行1件のJSONで追記するジャーナル。
+
+    出力ファイルは一時ファイルから置き換えた後に記録するため、記録された出力は
+    最後まで書き込まれています。追記は1行ずつ1回の書き込みで行い、スレッドや
+    ワーカープロセスから同時に記録しても行が混ざりません。中断時に書きかけだった
+    最後の行は読み込み時に無視します。
+
+    記録には入力ファイルのハッシュ値と処理パラメータのハッシュ値を含め、
+    どちらかが変わった入力の記録は使いません。
+
+    :param path: ジャーナルのパス
+    :param params_hash: 処理パラメータのハッシュ値（imgcore.manifest.params_digest）
+    """
+
+    def __init__(self, path, params_hash):
+        self.path = path
+        self.params_hash = params_hash
+        # 入力 -> {出力: 入力のハッシュ値}
+        self.entries = {}
+        # begin で渡された入力のハッシュ値
+        self.inputs = {}
+        self._file = None
+        self._lock = threading.Lock()
+        for entry in self._read():
+            if entry.get('params') == params_hash:
+                self.entries.setdefault(entry['input'], {})[entry['output']] = entry['state']
+
+    @classmethod
+    def for_output_dir(cls, output_dir, params_hash):
+        return cls(os.path.join(output_dir, JOURNAL_NAME), params_hash)
+
+    def __getstate__(self):
+        # ワーカープロセスにはファイルとロックを渡さない（プロセスごとに開き直す）
+        state = self.__dict__.copy()
+        state['_file'] = None
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 中断時に書きかけだった行
+                    continue
+                if isinstance(entry, dict) and {'input', 'output', 'state', 'params'} <= entry.keys():
+                    yield entry
+
+    def begin(self, key, state, reset=False):
+        """
+        入力の処理を始める前に呼び出し、入力が変わっている場合はその記録を破棄します。
+
+        :param key: 入力ファイル名
+        :param state: Manifest.input_state の戻り値
+        :param reset: Trueの場合は記録を全て破棄する（全て処理し直す場合）
+        """
+        self.inputs[key] = state['input']
+        done = self.entries.get(key)
+        if done is None:
+            return
+        if reset:
+            del self.entries[key]
+            return
+        for output in [o for o, digest in done.items() if digest != state['input']]:
+            del done[output]
+
+    def completed(self, key):
+        # 保存済みで、ファイルが残っている出力の集合
+        return {o for o in self.entries.get(key, ()) if os.path.exists(o)}
+
+    def record(self, key, output):
+        """
+        出力の保存を終えたことを記録します。begin を呼び出していない入力は記録しません。
+        """
+        digest = self.inputs.get(key)
+        if digest is None:
+            return
+        line = json.dumps({'input': key, 'output': output, 'state': digest, 'params': self.params_hash},
+                          ensure_ascii=False) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(line)
+            self._file.flush()
+            self.entries.setdefault(key, {})[output] = digest
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def discard(self, keys):
+        """
+        処理を終えた入力の記録を削除し、ジャーナルを書き直します。
+
+        ワーカープロセスが追記した記録も含めてファイルから読み直すため、
+        全ての処理が終わってから呼び出してください。残る記録がなければファイルを削除します。
+        """
+        self.close()
+        keys = set(keys)
+        remaining = [e for e in self._read() if e['params'] == self.params_hash and e['input'] not in keys]
+        for key in keys:
+            self.entries.pop(key, None)
+        if not remaining:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        # 途中で中断しても壊れないよう、一時ファイルに書いてから置き換える
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in remaining:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,40 @@
+import importlib
+
+# cv2・skimage・PIL は読み込みに時間がかかる（skimage は scipy も読み込むため数百ms）。
+# モジュールの先頭では読み込まず、最初に属性を参照したときに読み込むことで、
+# 実際に使う処理がある場合だけ読み込み時間がかかるようにする。
+
+
+class LazyModule:
+    """
+    最初に属性を参照したときにモジュールを読み込むプロキシ。
+
+    モジュールの先頭で `cv2 = lazy_import('cv2')` のように使い、以降は通常の import と同じように
+    `cv2.resize(...)` と参照します。読み込みは Python の import の仕組みで行うため、
+    複数のスレッドから同時に参照しても1回だけ読み込まれます。
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f'<lazy module {self._name!r} ({state})>'
+
+
+def lazy_import(name):
+    """
+    モジュールを参照したときに読み込むプロキシを返します。
+
+    :param name: モジュール名（'cv2', 'skimage.io', 'PIL.Image' など）
+    """
+    return LazyModule(name)
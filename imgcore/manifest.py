@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = '.manifest.json'
+HASH_CHUNK = 1 << 20
+
+
+def file_digest(file_path):
+    # ファイル内容のハッシュ値
+    h = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def params_digest(params):
+    # 処理パラメータのハッシュ値（キーの順序に依存しない）
+    text = json.dumps(params, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=20).hexdigest()
+
+
+class Manifest:
+    """
+    入力ファイルの内容と処理パラメータのハッシュ値、出力したファイルを記録し、
+    前回から変更のない入力の処理を省略するためのマニフェスト。
+
+    入力のハッシュ値はファイルサイズと更新日時が前回と同じ場合は再計算しません。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.dirty = 0
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    @classmethod
+    def for_output_dir(cls, output_dir):
+        return cls(os.path.join(output_dir, MANIFEST_NAME))
+
+    def input_state(self, key, file_path):
+        # 入力ファイルの状態 (サイズ, 更新日時, ハッシュ値)
+        st = os.stat(file_path)
+        entry = self.entries.get(key)
+        if entry is not None and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            digest = entry['input']
+        else:
+            digest = file_digest(file_path)
+        return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'input': digest}
+
+    def is_up_to_date(self, key, state, params_hash):
+        """
+        入力・パラメータが前回と同じで、前回の出力が全て存在する場合にTrueを返します。
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return False
+        if entry['input'] != state['input'] or entry['params'] != params_hash:
+            return False
+        return all(os.path.exists(p) for p in entry['outputs'])
+
+    def record(self, key, state, params_hash, outputs):
+        entry = dict(state)
+        entry['params'] = params_hash
+        entry['outputs'] = list(outputs)
+        self.entries[key] = entry
+        self.dirty += 1
+
+    def save(self):
+        # 途中で中断しても壊れないよう、一時ファイルに書いてから置き換える
+        if not self.dirty:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+        self.dirty = 0
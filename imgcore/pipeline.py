@@ -0,0 +1,204 @@
+import itertools
+import json
+from collections import Counter
+import os
+import re
+from imgcore.instrument import stage
+
+SOURCE = 'source'
+
+
+class Node:
+    """
+    パイプラインのDAGを構成するノード。
+
+    同じ入力ノードに対して同じ操作・同じパラメータを適用するノードは1つにまとめられ、
+    その結果は全ての子ノードと出力で共有されます。
+    """
+
+    def __init__(self, op, params, context):
+        self.op = op
+        self.params = params
+        # 出力ファイル名の書式に使うパラメータ（祖先ノードのパラメータを含む）
+        self.context = context
+        self.children = {}
+        self.outputs = []
+
+    def count(self):
+        # このノード以下の (操作数, 出力数)
+        ops = len(self.children)
+        outputs = len(self.outputs)
+        for child in self.children.values():
+            child_ops, child_outputs = child.count()
+            ops += child_ops
+            outputs += child_outputs
+        return ops, outputs
+
+
+def load_pipeline(path):
+    """
+    パイプライン定義ファイルを読み込みます。
+
+    拡張子が .yaml / .yml の場合はPyYAMLで、それ以外はJSONとして読み込みます。
+    """
+    with open(path, encoding='utf-8') as f:
+        if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def _freeze(value):
+    # JSONのリストはタプルに変換（色や座標はタプルで渡す）
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return {k: _freeze(v) for k, v in value.items()}
+    return value
+
+
+def _expand_sweep(params, sweep):
+    # sweepで指定されたパラメータの全組み合わせを展開
+    if not sweep:
+        yield dict(params)
+        return
+    keys = list(sweep)
+    for values in itertools.product(*(sweep[k] for k in keys)):
+        combined = dict(params)
+        combined.update(zip(keys, (_freeze(v) for v in values)))
+        yield combined
+
+
+def _param_key(params):
+    return tuple(sorted((k, repr(v)) for k, v in params.items()))
+
+
+def compile_pipeline(spec, ops):
+    """
+    パイプライン定義をDAGにコンパイルし、ルート（入力画像）ノードを返します。
+
+    定義の各ノードは次のキーを持ちます。
+
+    - id: ノード名（inputで参照する）
+    - op: ops に登録された操作名
+    - input: 入力とするノード名（省略時は入力画像 'source'）
+    - params: 操作に渡すパラメータ
+    - sweep: パラメータ名と値のリスト。全組み合わせに展開される
+    - output: 出力の指定（suffix, sub, ext, dpi）。省略した場合は中間結果として扱う
+
+    定義の最上位の encoder には出力形式とPNGのエンコード設定を指定できます
+    （format, compress_level, filter, strategy。imgcore.writer.encoder_settings を参照）。
+
+    :param spec: load_pipeline で読み込んだ定義
+    :param ops: 操作名から関数 func(image, **params) への辞書
+    """
+    root = Node(None, {}, {})
+    instances = {SOURCE: [root]}
+    for definition in spec['nodes']:
+        node_id = definition['id']
+        if node_id in instances:
+            raise ValueError(f'Duplicate node id: {node_id}')
+        op = definition['op']
+        if op not in ops:
+            raise ValueError(f'Unknown operation: {op}')
+        parent_id = definition.get('input', SOURCE)
+        if parent_id not in instances:
+            raise ValueError(f'Unknown input node: {parent_id} (referenced by {node_id})')
+        params = _freeze(definition.get('params', {}))
+        output = definition.get('output')
+
+        created = []
+        for parent in instances[parent_id]:
+            for combined in _expand_sweep(params, definition.get('sweep')):
+                key = (op, _param_key(combined))
+                node = parent.children.get(key)
+                if node is None:
+                    context = dict(parent.context)
+                    context.update(combined)
+                    node = Node(op, combined, context)
+                    parent.children[key] = node
+                if output is not None:
+                    node.outputs.append(output)
+                created.append(node)
+        instances[node_id] = created
+    return root
+
+
+def output_name(output, file_name, context, ext=None):
+    """
+    出力の指定からファイル名を求めます。
+
+    - sub: [正規表現, 置換文字列] を入力ファイル名に適用する（一致しない場合はファイル名を変えない）
+    - suffix: 入力ファイル名の拡張子の前に付ける文字列（{パラメータ名} で書式指定）
+    - ext: 出力の拡張子（省略時は入力ファイルと同じ）
+
+    :param ext: 出力の拡張子を全ての出力で置き換える（出力形式を指定した場合）
+    """
+    stem, input_ext = os.path.splitext(file_name)
+    ext = ext or output.get('ext', input_ext)
+    if 'sub' in output:
+        pattern, repl = output['sub']
+        stem = re.sub(pattern, repl, stem)
+    suffix = output.get('suffix', '')
+    return stem + suffix.format(**context) + ext
+
+
+def _output_paths(node, file_name, output_dir, ext):
+    # ノードの出力の (ファイルパス, 出力の指定) のリスト
+    return [(os.path.join(output_dir, output_name(output, file_name, node.context, ext)), output)
+            for output in node.outputs]
+
+
+def output_paths(root, file_name, output_dir, ext=None):
+    """
+    パイプラインを1枚の画像に適用したときに出力するファイルパスのリストを、画像を処理せずに求めます。
+    """
+    paths = [path for path, _ in _output_paths(root, file_name, output_dir, ext)]
+    for child in root.children.values():
+        paths.extend(output_paths(child, file_name, output_dir, ext))
+    return paths
+
+
+def run_pipeline(root, ops, image, file_name, output_dir, save, ext=None, done=()):
+    """
+    コンパイル済みのパイプラインを1枚の画像に適用します。
+
+    DAGを深さ優先でたどり、各ノードの結果は子ノードの処理が終わった時点で破棄するため、
+    同時に保持する中間画像はDAGの深さ分だけです。
+
+    :param root: compile_pipeline の戻り値
+    :param ops: 操作名から関数への辞書
+    :param image: 入力画像
+    :param file_name: 入力ファイル名（出力ファイル名の元になる）
+    :param output_dir: 出力先ディレクトリ
+    :param save: 保存関数 save(file_path, image, dpi)
+    :param ext: 出力の拡張子（省略時は出力の指定または入力ファイルと同じ）
+    :param done: 保存済みの出力のファイルパスの集合。これらは保存せず、
+        保存済みの出力しかないノード以下は処理しない（中断した処理の再開用）
+    :return: 出力したファイルパスのリスト（保存済みの出力を含む）
+    :raises ValueError: 複数の出力が同じファイルパスになる場合（sub の正規表現が入力ファイル名に一致しないなど）
+    """
+    # 同じパスへの保存はエンコーダのスレッドで競合するため、何も保存せずに失敗とする
+    counts = Counter(output_paths(root, file_name, output_dir, ext))
+    duplicates = sorted(path for path, n in counts.items() if n > 1)
+    if duplicates:
+        raise ValueError(f'Multiple outputs share the same path (check the output sub/suffix): {", ".join(duplicates)}')
+    outputs = []
+
+    def visit(node, node_image):
+        for new_name, output in _output_paths(node, file_name, output_dir, ext):
+            if new_name not in done:
+                save(new_name, node_image, output.get('dpi'))
+            outputs.append(new_name)
+        for child in node.children.values():
+            if done:
+                child_outputs = output_paths(child, file_name, output_dir, ext)
+                if all(p in done for p in child_outputs):
+                    outputs.extend(child_outputs)
+                    continue
+            with stage(child.op):
+                child_image = ops[child.op](node_image, **child.params)
+            visit(child, child_image)
+
+    visit(root, image)
+    return outputs
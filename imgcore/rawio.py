@@ -0,0 +1,95 @@
+import mmap
+import os
+import struct
+import numpy as np
+from imgcore.alpha import is_opaque
+
+# 非圧縮の画像ファイル（BMP、.npy）をメモリマップし、コピーせずにnumpy配列のビューとして扱う。
+
+
+def _map_file(file_path):
+    with open(file_path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def map_bmp_raw(file_path):
+    """
+    非圧縮BMP（24bit、32bit）をメモリマップし、ファイル上の画素の並び（BGR / BGRA）のままの
+    ビューを返します。
+
+    行のパディングはストライドで読み飛ばし、ボトムアップ形式は上下を反転したビューにするため、
+    画素データはコピーされません。
+
+    :return: (ビュー (高さ, 幅, 3 or 4), アルファチャンネルを持つかどうか)
+    :raises ValueError: 対応していない形式の場合
+    """
+    buffer = _map_file(file_path)
+    if buffer[:2] != b'BM' or len(buffer) < 54:
+        raise ValueError(f'Not a BMP file: {file_path}')
+    offset, = struct.unpack_from('<I', buffer, 10)
+    header_size, width, height, _, bpp, compression = struct.unpack_from('<IiiHHI', buffer, 14)
+    if bpp not in (24, 32) or compression not in (0, 3):
+        raise ValueError(f'Unsupported BMP format: {bpp}bit, compression={compression}')
+    alpha = False
+    if bpp == 32 and compression == 3:
+        masks = struct.unpack_from('<IIII', buffer, 54) if header_size >= 56 else (0, 0, 0, 0)
+        if masks[:3] != (0x00FF0000, 0x0000FF00, 0x000000FF):
+            raise ValueError(f'Unsupported BMP bit masks: {file_path}')
+        alpha = masks[3] == 0xFF000000
+
+    pixel_bytes = bpp // 8
+    stride = (width * pixel_bytes + 3) // 4 * 4
+    # 途中で切れたファイルはマップせず、通常の読み込みに任せる（最終行のパディングは省略されることがある）
+    if width <= 0 or height == 0 or len(buffer) < offset + stride * (abs(height) - 1) + width * pixel_bytes:
+        raise ValueError(f'Truncated BMP file: {file_path}')
+    raw = np.ndarray((abs(height), width, pixel_bytes), dtype=np.uint8, buffer=buffer,
+                     offset=offset, strides=(stride, pixel_bytes, 1))
+    if height > 0:
+        # ボトムアップ形式では画像の下の行からファイルに並んでいる
+        raw = raw[::-1]
+    return raw, alpha
+
+
+def map_bmp(file_path):
+    """
+    非圧縮BMPをRGB / RGBAの配列として読み込みます。
+
+    RGBはチャンネルの並びを逆順にしたビューなのでコピーされません。
+    RGBAはチャンネルの並べ替えのため1回だけコピーします。
+    """
+    raw, alpha = map_bmp_raw(file_path)
+    if alpha:
+        return raw[:, :, [2, 1, 0, 3]]
+    return raw[:, :, 2::-1]
+
+
+def map_npy(file_path):
+    # .npy をメモリマップして読み込む
+    return np.load(file_path, mmap_mode='r')
+
+
+def map_rgb(file_path, require_opaque=False):
+    """
+    BMP / .npy をメモリマップし、アルファチャンネルを除いたRGBのビューを返します。
+
+    余白の追加など、後段の処理が新しい配列に書き込む場合は、入力画像全体のコピーが不要になります。
+    対応していない形式の場合はNoneを返します。require_opaque がTrueの場合は、
+    アルファチャンネルに不透明でない画素があるときもNoneを返します（背景色への合成が必要なため）。
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    try:
+        if ext == '.bmp':
+            raw, alpha = map_bmp_raw(file_path)
+            if alpha and require_opaque and not is_opaque(raw):
+                return None
+            return raw[:, :, 2::-1]
+        if ext == '.npy':
+            image = map_npy(file_path)
+            if image.ndim == 3 and image.shape[2] == 4:
+                if require_opaque and not is_opaque(image):
+                    return None
+                return image[:, :, :3]
+            return image
+    except ValueError:
+        pass
+    return None
@@ -0,0 +1,45 @@
+import threading
+import numpy as np
+from imgcore.lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+
+# 最近傍補間の拡大縮小を行方向と列方向に分けて行う。
+# 列方向は cv2.resize で入力の行数分だけ計算し、行方向は選んだ行をコピーするだけにする。
+# 選ぶ行の番号は cv2.INTER_NEAREST と同じになるよう cv2 自身に計算させ、
+# (入力の行数, 出力の行数) ごとにキャッシュする（同じサイズのラベルが続くバッチでは再利用される）。
+
+_index_cache = {}
+_index_lock = threading.Lock()
+
+
+def nearest_indices(size, new_size):
+    """
+    cv2.INTER_NEAREST で size 個の画素を new_size 個に拡大縮小した場合に
+    各出力画素が参照する入力画素の番号を返します。結果はキャッシュされます。
+    """
+    key = (size, new_size)
+    indices = _index_cache.get(key)
+    if indices is None:
+        source = np.arange(size, dtype=np.int32).reshape(size, 1)
+        indices = cv2.resize(source, (1, new_size), interpolation=cv2.INTER_NEAREST).ravel().astype(np.intp)
+        indices.setflags(write=False)
+        with _index_lock:
+            _index_cache[key] = indices
+    return indices
+
+
+def resize_nearest(image, new_width, new_height):
+    """
+    cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_NEAREST) と
+    同じ結果を返します。
+
+    拡大では列方向だけを補間した後に行を複製し、縮小では必要な行だけを取り出してから
+    列方向を補間するため、補間の計算は小さい方の行数分だけになります。
+    """
+    height = image.shape[0]
+    rows = nearest_indices(height, new_height)
+    if new_height <= height:
+        return cv2.resize(image.take(rows, axis=0), (new_width, new_height), interpolation=cv2.INTER_NEAREST)
+    resized = cv2.resize(image, (new_width, height), interpolation=cv2.INTER_NEAREST)
+    return resized.take(rows, axis=0)
@@ -0,0 +1,180 @@
+import os
+import re
+import queue
+import threading
+
+# 入力ファイルを os.scandir で探し、見つけた順に返す。
+# 一覧を全て作ってから処理を始めるのではなく、見つけたファイルから処理を始められるようにする。
+# scandir はディレクトリの読み込み時に種類も取得するため、ファイルごとに stat を呼ばない。
+
+ORDERS = ('none', 'name', 'natural')
+# バックグラウンドで探索する場合に先読みする最大件数
+DEFAULT_PREFETCH = 1024
+
+
+def add_scan_arguments(parser):
+    # 入力ファイルの探索のコマンドライン引数を追加
+    parser.add_argument('--pattern', action='append', default=None, metavar='GLOB',
+                        help='対象とするファイルのパターン（入力ディレクトリからの相対パス。**で任意の階層。複数指定可）')
+    parser.add_argument('--recursive', action='store_true',
+                        help='サブディレクトリも探索する（出力にも同じディレクトリ構成を作る）')
+    parser.add_argument('--ignore-case', action='store_true',
+                        help='拡張子とパターンの大文字・小文字を区別しない')
+    parser.add_argument('--order', choices=ORDERS, default='none',
+                        help='処理する順序（none: 見つけた順、name: 名前順、natural: 数字を数値として比較した名前順）')
+    return parser
+
+
+def scan_options(args):
+    # add_scan_arguments の引数から scan_files のキーワード引数を作る
+    return {
+        'patterns': args.pattern,
+        'recursive': args.recursive or any('/' in p for p in args.pattern or ()),
+        'ignore_case': args.ignore_case,
+        'order': args.order,
+    }
+
+
+def glob_to_regex(pattern, ignore_case=False):
+    """
+    グロブパターンを正規表現に変換します。
+
+    * と ? は / をまたがず、** は任意の階層（0階層を含む）に一致します。
+    """
+    i, n = 0, len(pattern)
+    parts = []
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            parts.append('.*')
+            i += 2
+            continue
+        if c == '*':
+            parts.append('[^/]*')
+        elif c == '?':
+            parts.append('[^/]')
+        elif c == '[':
+            j = pattern.find(']', i + 1)
+            if j < 0:
+                parts.append(re.escape(c))
+            else:
+                body = pattern[i + 1:j]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                parts.append('[' + body.replace('\\', '\\\\') + ']')
+                i = j
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return re.compile(''.join(parts) + r'\Z', re.IGNORECASE if ignore_case else 0)
+
+
+def _natural_key(name):
+    # 'img10' が 'img9' の後になるよう、数字の部分を数値として比較する
+    return [(0, int(t), '') if t.isdigit() else (1, 0, t.lower()) for t in re.split(r'(\d+)', name)]
+
+
+def _sorted_entries(entries, order):
+    if order == 'name':
+        return sorted(entries, key=lambda e: e.name)
+    if order == 'natural':
+        return sorted(entries, key=lambda e: _natural_key(e.name))
+    return entries
+
+
+def scan_files(dir_path, exts=None, patterns=None, recursive=False, ignore_case=False, order='none'):
+    """
+    ディレクトリ内のファイルを探し、入力ディレクトリからの相対パス（区切りは /）を返すジェネレータ。
+
+    order が none の場合はディレクトリを読みながら返します。name / natural の場合は
+    ディレクトリごとに並べ替えるため、そのディレクトリを読み終えてから返し始めます。
+
+    :param dir_path: 入力ディレクトリ
+    :param exts: 拡張子（'.bmp'）または拡張子のリスト
+    :param patterns: グロブパターンのリスト（いずれかに一致するファイルを返す）
+    :param recursive: サブディレクトリも探索するかどうか
+    :param ignore_case: 拡張子とパターンの大文字・小文字を区別しないかどうか
+    :param order: 'none', 'name', 'natural' のいずれか
+    """
+    if order not in ORDERS:
+        raise ValueError(f'Invalid order: {order}')
+    if isinstance(exts, str):
+        exts = [exts]
+    if exts is not None:
+        exts = {e.lower() for e in exts} if ignore_case else set(exts)
+    regexes = [glob_to_regex(p, ignore_case) for p in patterns or ()]
+
+    def matches(rel_path, name):
+        if exts is not None:
+            ext = os.path.splitext(name)[1]
+            if (ext.lower() if ignore_case else ext) not in exts:
+                return False
+        return not regexes or any(r.match(rel_path) for r in regexes)
+
+    def walk(path, prefix):
+        with os.scandir(path) as it:
+            entries = it if order == 'none' else list(it)
+            subdirs = []
+            for entry in _sorted_entries(entries, order):
+                rel_path = prefix + entry.name
+                try:
+                    if entry.is_file():
+                        if matches(rel_path, entry.name):
+                            yield rel_path
+                    elif recursive and entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry)
+                except OSError:
+                    continue
+        for entry in subdirs:
+            yield from walk(entry.path, prefix + entry.name + '/')
+
+    yield from walk(dir_path, '')
+
+
+def prefetch(iterable, max_queued=DEFAULT_PREFETCH):
+    """
+    iterable をバックグラウンドのスレッドで先読みするジェネレータ。
+
+    ネットワーク上のディレクトリの探索を、見つかったファイルの処理と並行させるために使います。
+    探索中の例外は呼び出し側で送出されます。
+    """
+    items = queue.Queue(max_queued)
+    done = object()
+    stop = threading.Event()
+
+    def put(value):
+        # 呼び出し側が途中でやめた場合に、空きを待ったまま止まらないようにする
+        while not stop.is_set():
+            try:
+                items.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((done, e))
+            return
+        put((done, None))
+
+    thread = threading.Thread(target=produce, name='scan', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,151 @@
+from collections.abc import Mapping
+import numpy as np
+from imgcore.lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+
+# 画像の統計量（最小値・最大値・平均・チャンネルごとのヒストグラム・アルファの使用有無）を求める。
+# 値は参照されたときに初めて計算し、同時に要求された値は画像を1回走査するだけで求める。
+# 走査は行をまとめた短冊単位で行うため、大きな画像でも作業用のメモリは短冊の分だけで済む。
+
+DEFAULT_CHUNK_ROWS = 256
+
+# 走査せずに分かる値
+_STATIC = ('shape', 'dtype')
+# 走査が必要な値
+SCAN_FIELDS = ('min', 'max', 'mean', 'histogram', 'alpha_used')
+# cv2.minMaxLoc / cv2.calcHist が扱えるデータ型
+_CV_DTYPES = {np.dtype(t) for t in (np.uint8, np.int8, np.uint16, np.int16, np.int32, np.float32, np.float64)}
+_HIST_BINS = {np.dtype(np.uint8): 256, np.dtype(np.uint16): 65536}
+
+
+def _channels(image):
+    return image.shape[2] if image.ndim == 3 else 1
+
+
+def _min_max(chunk):
+    # 1回の走査で最小値と最大値を求める（cv2が扱えない型は numpy で2回）
+    if chunk.dtype in _CV_DTYPES and chunk.flags.c_contiguous and chunk.size:
+        lo, hi = cv2.minMaxLoc(chunk.reshape(chunk.shape[0], -1))[:2]
+        return lo, hi
+    return chunk.min(), chunk.max()
+
+
+def _histogram(chunk, bins):
+    # チャンネルごとのヒストグラム (チャンネル数, ビン数)
+    chunk = np.ascontiguousarray(chunk)
+    return np.stack([cv2.calcHist([chunk], [c], None, [bins], [0, bins]).ravel()
+                     for c in range(_channels(chunk))]).astype(np.int64)
+
+
+class ImageStats(Mapping):
+    """
+    画像の統計量を遅延評価で返す辞書。
+
+    stats['min'] のように参照すると、その値だけを1回の走査で求めます。複数の値を使う場合は
+    compute('min', 'max', 'histogram') のように先にまとめて要求すると走査は1回で済みます。
+    ヒストグラムを求める場合、最小値・最大値・平均はヒストグラムから求めるため追加の走査はありません。
+
+    :param image: 入力画像（H×W または H×W×C）
+    :param keys: 辞書として列挙するキー（省略時は全て。ヒストグラムに対応しないデータ型では histogram を除く）
+    :param chunk_rows: 1回に走査する行数
+    :param sample: 何行ごとに走査するか（2以上の場合は近似値になる）
+    """
+
+    def __init__(self, image, keys=None, chunk_rows=DEFAULT_CHUNK_ROWS, sample=1):
+        self.image = image
+        if keys is None:
+            keys = [k for k in _STATIC + SCAN_FIELDS if k != 'histogram' or image.dtype in _HIST_BINS]
+        self._keys = tuple(keys)
+        self.chunk_rows = chunk_rows
+        self.sample = sample
+        self._values = {'shape': image.shape, 'dtype': image.dtype}
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            if key not in SCAN_FIELDS:
+                raise KeyError(key)
+            self.compute(key)
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return f'ImageStats({dict(self)!r})'
+
+    def _chunks(self):
+        image = self.image[::self.sample] if self.sample > 1 else self.image
+        for y in range(0, image.shape[0], self.chunk_rows):
+            yield image[y:y + self.chunk_rows]
+
+    def compute(self, *fields):
+        """
+        指定した値（省略時は列挙するキーの全て）を1回の走査で求めます。
+
+        :return: self
+        """
+        fields = [f for f in (fields or self._keys) if f in SCAN_FIELDS and f not in self._values]
+        if not fields:
+            return self
+        image = self.image
+        channels = _channels(image)
+        bins = _HIST_BINS.get(image.dtype)
+        if 'histogram' in fields and bins is None:
+            raise ValueError(f'Histogram is not supported for dtype: {image.dtype}')
+        # ヒストグラムがあれば最小値・最大値・平均はそこから求める
+        use_hist = bins is not None and 'histogram' in fields
+        want_minmax = not use_hist and ('min' in fields or 'max' in fields)
+        want_mean = not use_hist and 'mean' in fields
+        want_alpha = 'alpha_used' in fields
+        alpha_max = np.iinfo(image.dtype).max if image.dtype.kind in 'ui' else 1.0
+
+        lo = hi = None
+        total = np.zeros(channels)
+        hist = np.zeros((channels, bins), dtype=np.int64) if use_hist else None
+        alpha_used = False
+        count = 0
+        for chunk in self._chunks():
+            if use_hist:
+                hist += _histogram(chunk, bins)
+            if want_minmax:
+                c_lo, c_hi = _min_max(chunk)
+                lo = c_lo if lo is None else min(lo, c_lo)
+                hi = c_hi if hi is None else max(hi, c_hi)
+            if want_mean:
+                total += chunk.reshape(-1, channels).sum(axis=0, dtype=np.float64)
+            if want_alpha and channels == 4 and not alpha_used:
+                alpha_used = bool(chunk[:, :, 3].min() < alpha_max)
+            count += chunk.shape[0] * chunk.shape[1]
+            if want_alpha and alpha_used and not (use_hist or want_minmax or want_mean):
+                # アルファの使用有無だけが必要な場合は見つかった時点で終了
+                break
+
+        if use_hist:
+            values = self._values
+            values['histogram'] = hist
+            used = np.nonzero(hist.sum(axis=0))[0]
+            values['min'] = image.dtype.type(used[0]) if used.size else None
+            values['max'] = image.dtype.type(used[-1]) if used.size else None
+            if count:
+                values['mean'] = (hist @ np.arange(bins)) / count
+        if want_minmax:
+            self._values['min'] = image.dtype.type(lo) if lo is not None else None
+            self._values['max'] = image.dtype.type(hi) if hi is not None else None
+        if want_mean:
+            self._values['mean'] = total / count if count else None
+        if want_alpha:
+            self._values['alpha_used'] = alpha_used
+        return self
+
+
+def image_info(image):
+    """
+    main.py / edit.py の image_info と同じキー（shape, dtype, min, max）を持つ辞書を返します。
+
+    shape と dtype は走査せずに返し、min / max は参照されたときに1回の走査で求めます。
+    """
+    return ImageStats(image, keys=('shape', 'dtype', 'min', 'max'))
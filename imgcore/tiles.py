@@ -0,0 +1,196 @@
+import os
+import numpy as np
+from imgcore.tone import apply_tone
+from imgcore.alpha import WHITE, to_rgb
+from imgcore.writer import PngStreamWriter, atomic_output
+from imgcore.resize import nearest_indices
+from imgcore.rawio import map_bmp_raw, map_npy
+from imgcore.instrument import stage
+from imgcore.lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+io = lazy_import('skimage.io')
+
+# 画像を短冊（数行ずつのまとまり）単位で処理し、デコーダからエンコーダまで
+# 画像全体をメモリに展開せずに流すためのモジュール。
+# 入力と各処理は shape, dtype と read_rows(y0, y1) を持ち、下流の処理が
+# 必要な行だけを上流から読み出す。
+
+DEFAULT_STRIP_ROWS = 256
+
+
+class ArrayStrips:
+    """
+    メモリ上の配列（または np.memmap などのビュー）を短冊の入力として扱う。
+
+    channels を指定した場合は、読み出した短冊ごとにチャンネルを並べ替える。
+    """
+
+    def __init__(self, array, channels=None):
+        self.array = array
+        self.channels = channels
+        if channels is None:
+            self.shape = array.shape
+        else:
+            self.shape = array.shape[:2] + array[:1, :1, channels].shape[2:]
+        self.dtype = array.dtype
+
+    def read_rows(self, y0, y1):
+        rows = self.array[y0:y1]
+        if self.channels is not None:
+            rows = rows[:, :, self.channels]
+        return np.asarray(rows)
+
+
+def open_strips(file_path):
+    """
+    画像ファイルを短冊の入力として開きます。
+
+    非圧縮BMPと .npy はメモリマップし、必要な行だけをファイルから読み込みます。
+    それ以外の形式は全体をデコードしてから短冊に分割します。
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == '.bmp':
+        try:
+            raw, alpha = map_bmp_raw(file_path)
+            # BGR(A) -> RGB(A)
+            return ArrayStrips(raw, [2, 1, 0, 3] if alpha else slice(2, None, -1))
+        except ValueError:
+            pass
+    elif ext == '.npy':
+        return ArrayStrips(map_npy(file_path))
+    return ArrayStrips(io.imread(file_path))
+
+
+class CanvasStrips:
+    # resize_canvas と同じく、上下左右に余白を追加する
+    def __init__(self, source, tmargin, lmargin, bmargin, rmargin, color=(0, 0, 0, 0)):
+        self.source = source
+        self.tmargin = tmargin
+        self.lmargin = lmargin
+        height, width, channels = source.shape
+        self.shape = (height + tmargin + bmargin, width + lmargin + rmargin, channels)
+        self.dtype = source.dtype
+        self.color = color
+
+    def read_rows(self, y0, y1):
+        height, width, channels = self.source.shape
+        rows = np.empty((y1 - y0, self.shape[1], channels), dtype=self.dtype)
+        # batched.resize_canvas と同じく、色はチャンネル数に合わせて切り詰める
+        rows[:, :] = self.color[:channels]
+        src0 = max(y0 - self.tmargin, 0)
+        src1 = min(y1 - self.tmargin, height)
+        if src0 < src1:
+            dst0 = src0 + self.tmargin - y0
+            rows[dst0:dst0 + src1 - src0, self.lmargin:self.lmargin + width] = self.source.read_rows(src0, src1)
+        return rows
+
+
+class ChannelStrips:
+    # RGBAをRGBにする（rgba2rgb と同じく、半透明の画素は background に合成する）
+    def __init__(self, source, channels=3, background=WHITE):
+        self.source = source
+        self.background = background
+        self.channels = min(channels, source.shape[2])
+        self.shape = source.shape[:2] + (self.channels,)
+        self.dtype = source.dtype
+
+    def read_rows(self, y0, y1):
+        rows = self.source.read_rows(y0, y1)
+        if self.channels == 3 and rows.shape[2] == 4:
+            return to_rgb(rows, self.background)
+        return rows[:, :, :self.channels]
+
+
+class ToneStrips:
+    # imgcore.tone のトーン操作を行ごとに適用する
+    def __init__(self, source, steps):
+        self.source = source
+        self.steps = steps
+        self.shape = source.shape
+        self.dtype = source.dtype
+
+    def read_rows(self, y0, y1):
+        return apply_tone(self.source.read_rows(y0, y1), self.steps)
+
+
+class ResizeStrips:
+    """
+    resize_image と同じ出力サイズで拡大縮小する。
+
+    nearest は cv2.INTER_NEAREST と同じ画素を選び、bilinear / bicubic は
+    必要な上下の行を含めて読み込み cv2.remap で補間します。
+    """
+
+    # (cv2の補間方法の名前, 補間に必要な上下の行数)
+    _INTERPOLATION = {
+        'bilinear': ('INTER_LINEAR', 1),
+        'bicubic': ('INTER_CUBIC', 2),
+    }
+
+    def __init__(self, source, scale, method='bicubic'):
+        if method != 'nearest' and method not in self._INTERPOLATION:
+            raise ValueError('Invalid method')
+        self.source = source
+        self.method = method
+        height, width, channels = source.shape
+        new_width, new_height = int(width * scale), int(height * scale)
+        self.shape = (new_height, new_width, channels)
+        self.dtype = source.dtype
+        if method == 'nearest':
+            self._xs = nearest_indices(width, new_width)
+            self._ys = nearest_indices(height, new_height)
+        else:
+            self._xs = ((np.arange(new_width) + 0.5) * (width / new_width) - 0.5).astype(np.float32)
+            self._ys = (np.arange(new_height) + 0.5) * (height / new_height) - 0.5
+
+    def read_rows(self, y0, y1):
+        height = self.source.shape[0]
+        if self.method == 'nearest':
+            ys = self._ys[y0:y1]
+            src0, src1 = ys[0], ys[-1] + 1
+            rows = self.source.read_rows(src0, src1)
+            return rows[(ys - src0)[:, None], self._xs]
+
+        name, halo = self._INTERPOLATION[self.method]
+        interpolation = getattr(cv2, name)
+        ys = self._ys[y0:y1]
+        src0 = max(int(np.floor(ys[0])) - halo, 0)
+        src1 = min(int(np.floor(ys[-1])) + halo + 1, height)
+        rows = np.ascontiguousarray(self.source.read_rows(src0, src1))
+        map_x = np.broadcast_to(self._xs, (y1 - y0, self.shape[1]))
+        map_y = np.broadcast_to((ys - src0).astype(np.float32)[:, None], (y1 - y0, self.shape[1]))
+        out = cv2.remap(rows, np.ascontiguousarray(map_x), np.ascontiguousarray(map_y),
+                        interpolation, borderMode=cv2.BORDER_REPLICATE)
+        return out.reshape((y1 - y0,) + self.shape[1:])
+
+
+def iter_strips(source, strip_rows=DEFAULT_STRIP_ROWS):
+    # 上から順に短冊を返す
+    height = source.shape[0]
+    for y0 in range(0, height, strip_rows):
+        yield source.read_rows(y0, min(y0 + strip_rows, height))
+
+
+def stream_to_png(source, file_path, dpi=None, strip_rows=DEFAULT_STRIP_ROWS, options=None):
+    """
+    短冊の処理結果をPNGに書き出します。同時に保持するのは数個の短冊だけです。
+
+    :param source: 短冊の入力または処理
+    :param file_path: 出力先のファイルパス
+    :param dpi: 書き込むDPI
+    :param strip_rows: 1回に処理する行数
+    :param options: PNGのエンコード設定 {'compress_level', 'filter', 'strategy'}（filter の auto は none として扱う）
+    """
+    options = options or {}
+    png_filter = options.get('filter', 'auto')
+    height, width = source.shape[:2]
+    channels = source.shape[2] if len(source.shape) == 3 else 1
+    with stage('stream') as event, atomic_output(file_path) as tmp_path:
+        with PngStreamWriter(tmp_path, width, height, channels, source.dtype, dpi,
+                             compress_level=options.get('compress_level', 6),
+                             png_filter='none' if png_filter == 'auto' else png_filter,
+                             strategy=options.get('strategy', 'default')) as writer:
+            for rows in iter_strips(source, strip_rows):
+                writer.write_rows(rows)
+        event['bytes_written'] = os.path.getsize(tmp_path)
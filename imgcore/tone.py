@@ -0,0 +1,115 @@
+import threading
+import numpy as np
+from imgcore.lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+
+# 画素値ごとに独立した変換（トーン操作）を、ルックアップテーブル(LUT)にまとめて1パスで適用する。
+# 各操作は値域の最大値 maxval を受け取り、uint8 では 255、uint16 では 65535 となる。
+
+
+def _brightness_contrast(x, maxval, alpha, beta):
+    # betaは8bitの値で指定する
+    return alpha * x + beta * (maxval / 255)
+
+
+def _negative(x, maxval):
+    return maxval - x
+
+
+def _gamma(x, maxval, gamma):
+    return maxval * (x / maxval) ** (1.0 / gamma)
+
+
+def _threshold(x, maxval, threshold):
+    return np.where(x >= threshold * (maxval / 255), maxval, 0)
+
+
+TONE_OPS = {
+    'brightness_contrast': _brightness_contrast,
+    'negative': _negative,
+    'gamma': _gamma,
+    'threshold': _threshold,
+}
+
+_MAXVAL = {
+    np.dtype(np.uint8): 255,
+    np.dtype(np.uint16): 65535,
+}
+
+_lut_cache = {}
+_lut_lock = threading.Lock()
+
+
+def _steps_key(steps):
+    return tuple((name, tuple(sorted(params.items()))) for name, params in steps)
+
+
+def _apply_steps(values, steps, maxval, dtype):
+    # 各ステップの後で値域に丸め込む（元の関数を順に適用した場合と同じ結果になる）
+    for name, params in steps:
+        values = TONE_OPS[name](values.astype(np.float64), maxval, **params)
+        values = np.clip(values, 0, maxval).astype(dtype)
+    return values
+
+
+def tone_lut(steps, dtype=np.uint8):
+    """
+    トーン操作の列を1つのLUTに合成します。結果はキャッシュされます。
+
+    :param steps: (操作名, パラメータの辞書) のリスト。操作名は TONE_OPS のキー
+    :param dtype: np.uint8 または np.uint16
+    :return: 全ての入力値に対する出力値の配列
+    """
+    dtype = np.dtype(dtype)
+    if dtype not in _MAXVAL:
+        raise ValueError(f'LUT is not supported for dtype: {dtype}')
+    key = (_steps_key(steps), dtype)
+    lut = _lut_cache.get(key)
+    if lut is None:
+        maxval = _MAXVAL[dtype]
+        lut = _apply_steps(np.arange(maxval + 1), steps, maxval, dtype)
+        lut.setflags(write=False)
+        with _lut_lock:
+            _lut_cache[key] = lut
+    return lut
+
+
+def apply_lut(image, lut, inplace=False):
+    """
+    画像にLUTを適用します。
+
+    :param image: uint8 または uint16 の画像
+    :param lut: tone_lut で作成したLUT
+    :param inplace: Trueの場合は入力画像を書き換える
+    """
+    if image.dtype == np.uint8 and image.ndim <= 3 and (image.ndim < 3 or image.shape[2] <= 4):
+        if inplace and image.flags.c_contiguous:
+            return cv2.LUT(image, lut, dst=image)
+        return cv2.LUT(image, lut)
+    if inplace:
+        np.take(lut, image, out=image)
+        return image
+    return np.take(lut, image)
+
+
+def apply_tone(image, steps, inplace=False):
+    """
+    トーン操作の列を画像に1パスで適用します。
+
+    uint8 / uint16 はLUTを合成して適用し、浮動小数点の画像（値域0-1）は
+    float32で各操作を順に計算します。
+
+    :param image: 入力画像
+    :param steps: (操作名, パラメータの辞書) のリスト
+    :param inplace: Trueの場合は入力画像を書き換える
+    """
+    if image.dtype in _MAXVAL:
+        return apply_lut(image, tone_lut(steps, image.dtype), inplace)
+    if image.dtype.kind != 'f':
+        raise ValueError(f'Unsupported dtype: {image.dtype}')
+    values = image if inplace else image.astype(np.float32)
+    for name, params in steps:
+        values[...] = TONE_OPS[name](values, 1.0, **params)
+        np.clip(values, 0.0, 1.0, out=values)
+    return values
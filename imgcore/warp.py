@@ -0,0 +1,337 @@
+import math
+import threading
+from collections import OrderedDict
+import numpy as np
+from imgcore.lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+Image = lazy_import('PIL.Image')
+
+# 行列はすべて 3x3 の順方向（入力座標 -> 出力座標）で扱い、
+# 座標はPILと同じく画素の左上隅を原点とする連続座標とする
+
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+
+# 変換プランのキャッシュに保持するマスクの合計サイズの上限
+PLAN_CACHE_BYTES = 256 << 20
+
+
+def translate(tx, ty):
+    return np.array([[1.0, 0.0, tx], [0.0, 1.0, ty], [0.0, 0.0, 1.0]])
+
+
+def rotation_matrix(angle, center):
+    """
+    PIL.Image.rotate と同じ向き（反時計回り）の回転行列を返します。
+
+    :param angle: 回転角度（度数法で指定）
+    :param center: 回転の中心 (x, y)
+    """
+    rad = math.radians(angle)
+    c = round(math.cos(rad), 15)
+    s = round(math.sin(rad), 15)
+    cx, cy = center
+    rotate = np.array([[c, s, 0.0], [-s, c, 0.0], [0.0, 0.0, 1.0]])
+    return translate(cx, cy) @ rotate @ translate(-cx, -cy)
+
+
+def rotate_expand_plan(width, height, angle):
+    """
+    edit.py の rotate_image(expand=True) と同じく、回転後の画像全体が収まる白いキャンバスの
+    中央に画像を貼り付けてから回転する変換を返します。
+
+    :return: (順方向の行列, キャンバスサイズ (幅, 高さ))
+    """
+    rad = math.radians(angle)
+    new_w = abs(width * math.cos(rad)) + abs(height * math.sin(rad))
+    new_h = abs(height * math.cos(rad)) + abs(width * math.sin(rad))
+    canvas_w = int(math.ceil(new_w))
+    canvas_h = int(math.ceil(new_h))
+    paste = translate((canvas_w - width) // 2, (canvas_h - height) // 2)
+    rotate = rotation_matrix(angle, (canvas_w / 2.0, canvas_h / 2.0))
+    return rotate @ paste, (canvas_w, canvas_h)
+
+
+def _shear_inverse(width, height, angle_degrees, direction, shear_direction):
+    # edit.py の shear_image_with_angle が PIL の Image.transform に渡す逆変換行列と出力サイズ
+    shear_factor = math.tan(math.radians(angle_degrees))
+    if shear_direction == 'left':
+        shear_factor = -shear_factor
+
+    if direction == 'horizontal':
+        xshift = abs(shear_factor) * height
+        size = (width + int(math.ceil(xshift)), height)
+        data = (1, shear_factor, -xshift if shear_factor > 0 else 0, 0, 1, 0)
+    elif direction == 'vertical':
+        yshift = abs(shear_factor) * width
+        size = (width, height + int(math.ceil(yshift)))
+        data = (1, 0, 0, shear_factor, 1, -yshift if shear_factor > 0 else 0)
+    else:
+        raise ValueError("Invalid direction: choose 'horizontal' or 'vertical'")
+    return data, size
+
+
+def shear_plan(width, height, angle_degrees, direction='horizontal', shear_direction='right'):
+    """
+    edit.py の shear_image_with_angle と同じシアー変換を返します。
+
+    :return: (順方向の行列, 出力サイズ (幅, 高さ))
+    """
+    data, size = _shear_inverse(width, height, angle_degrees, direction, shear_direction)
+    inverse = np.array([data[:3], data[3:], (0.0, 0.0, 1.0)], dtype=np.float64)
+    return np.linalg.inv(inverse), size
+
+
+def _to_pixel_index(matrix):
+    # 連続座標の行列を、OpenCVの画素インデックス座標（画素中心が整数）の行列に変換
+    return translate(-0.5, -0.5) @ matrix @ translate(0.5, 0.5)
+
+
+def _as_rgb(image):
+    # rotate_image はRGBのキャンバスに貼り付けるため、出力は常にRGBになる
+    if image.ndim == 2:
+        return np.stack([image] * 3, axis=-1)
+    if image.shape[2] == 4:
+        return image[:, :, :3]
+    return image
+
+
+def rotate_right_angle(image, angle):
+    """
+    90度単位の回転（反時計回り）を、画素をコピーせずに配列のビューとして返します。
+
+    PIL.Image.rotate(angle, expand=True) と同じ結果です。ビューは読み取り専用で、
+    保存時のエンコードで初めて画素が並べ替えられます。
+
+    :raises ValueError: angle が90の倍数でない場合
+    """
+    if angle % 90 != 0:
+        raise ValueError(f'Not a right angle: {angle}')
+    view = np.rot90(image, int(angle // 90) % 4)
+    view.flags.writeable = False
+    return view
+
+
+def _axis_slice(sign, start, n, limit):
+    # 出力の 0..n-1 番目が入力の start + sign * i 番目になるスライス（入力の範囲外を含む場合はNone）
+    if sign > 0:
+        return slice(start, start + n) if start >= 0 and start + n <= limit else None
+    stop = start - n
+    return slice(start, stop if stop >= 0 else None, -1) if stop >= -1 and start < limit else None
+
+
+def _right_angle_axes(inverse):
+    """
+    画素インデックス座標の逆変換が90度単位の回転・反転と整数の平行移動の場合に、
+    (軸を入れ替えるかどうか, (行の向き, 行の開始位置), (列の向き, 列の開始位置)) を返します。
+    それ以外の変換はNoneを返します。
+    """
+    linear = inverse[:, :2]
+    rounded = np.round(linear)
+    offset = np.round(inverse[:, 2])
+    if not (np.allclose(linear, rounded, atol=1e-9) and np.allclose(inverse[:, 2], offset, atol=1e-6)):
+        return None
+    if not (set(np.abs(rounded).sum(axis=0)) == {1} and set(np.abs(rounded).sum(axis=1)) == {1}):
+        return None
+    (a, b), (c, d) = rounded.astype(int)
+    tx, ty = offset.astype(int)
+    if b == 0:
+        # 入力 (x, y) = (a * x + tx, d * y + ty)
+        return False, (d, ty), (a, tx)
+    # 入力 (x, y) = (b * y + tx, c * x + ty)。転置した入力の (行, 列) = (x, y) として扱う
+    return True, (b, tx), (c, ty)
+
+
+class WarpPlan:
+    """
+    同じサイズの画像に同じ変換を繰り返し適用するための事前計算。
+
+    出力サイズ、OpenCVの画素インデックス座標での逆変換行列と、元の処理で黒くなる領域を
+    0とするマスクを保持します。マスクは読み取り専用で、全ての呼び出しで共有されます。
+
+    変換が90度単位の回転・反転と整数の平行移動だけで、出力が入力の範囲内に収まる場合は
+    再サンプリングせず、入力画像のビュー（マスクで黒くする領域がなければコピーもしない）を返します。
+    """
+
+    def __init__(self, size, forward, mask, border_mode=None, border_value=BLACK):
+        # border_mode の省略時は cv2.BORDER_REPLICATE（cv2 はモジュールの読み込み時には読み込まない）
+        if border_mode is None:
+            border_mode = cv2.BORDER_REPLICATE
+        self.size = size
+        self.inverse = np.linalg.inv(_to_pixel_index(forward))[:2]
+        self.axes = _right_angle_axes(self.inverse)
+        self.mask = mask
+        self.mask.setflags(write=False)
+        self.opaque = bool(mask.all())
+        self.border_mode = border_mode
+        self.border_value = border_value
+        self.nbytes = mask.nbytes
+
+    def _view(self, image):
+        # 90度単位の回転・反転に当たる入力画像のビュー（入力の範囲外を参照する場合はNone）
+        if self.axes is None:
+            return None
+        transpose, (row_sign, row_start), (col_sign, col_start) = self.axes
+        if transpose:
+            image = image.swapaxes(0, 1)
+        width, height = self.size
+        rows = _axis_slice(row_sign, row_start, height, image.shape[0])
+        cols = _axis_slice(col_sign, col_start, width, image.shape[1])
+        if rows is None or cols is None:
+            return None
+        return image[rows, cols]
+
+    def apply(self, image):
+        view = self._view(image)
+        if view is not None:
+            if not self.opaque:
+                return view * (self.mask if view.ndim == 2 else self.mask[:, :, None])
+            view = view.view()
+            view.flags.writeable = False
+            return view
+        output = cv2.warpAffine(np.ascontiguousarray(image), self.inverse, self.size,
+                                flags=cv2.INTER_CUBIC | cv2.WARP_INVERSE_MAP,
+                                borderMode=self.border_mode, borderValue=self.border_value)
+        mask = self.mask if output.ndim == 2 else self.mask[:, :, None]
+        np.multiply(output, mask, out=output)
+        return output
+
+
+class PlanCache:
+    """
+    変換プランのLRUキャッシュ。保持するマスクの合計が max_bytes を超えると、
+    最も長く使われていないプランから破棄します。
+
+    edit.py のように1枚の画像に数百通りの変換を順に適用する場合、保持できるプランの数が
+    変換の数より少ないと毎回全て作り直すことになるため、件数ではなくサイズで上限を決めます。
+    """
+
+    def __init__(self, max_bytes=PLAN_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                return plan
+        plan = build()
+        with self._lock:
+            if key not in self._plans:
+                self._plans[key] = plan
+                self.nbytes += plan.nbytes
+            while self.nbytes > self.max_bytes and len(self._plans) > 1:
+                _, evicted = self._plans.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return plan
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+            self.nbytes = 0
+
+
+plans = PlanCache()
+
+
+def _pil_rotate_inverse(width, height, angle):
+    # PIL.Image.rotate(angle, expand=False) が Image.transform に渡す逆変換行列（PILと同じ計算）
+    rad = -math.radians(angle % 360.0)
+    cx, cy = width / 2.0, height / 2.0
+    a, b = round(math.cos(rad), 15), round(math.sin(rad), 15)
+    d, e = round(-math.sin(rad), 15), round(math.cos(rad), 15)
+    return (a, b, a * -cx + b * -cy + 0.0 + cx, d, e, d * -cx + e * -cy + 0.0 + cy)
+
+
+def _coverage_mask(size, data, width, height):
+    """
+    PILの Image.transform（AFFINE）が入力画像の内側として補間し、黒にしない出力画素を1とするマスク。
+
+    PILは出力画素の中心を逆変換した座標が [0, width) x [0, height) に入る画素だけを補間するため、
+    同じ順序の倍精度の計算で判定し、縁の1画素まで元の処理と一致させます。
+
+    :param size: 出力サイズ (幅, 高さ)
+    :param data: PILに渡す逆変換行列の6要素
+    """
+    a, b, c, d, e, f = data
+    x = np.arange(size[0], dtype=np.float64) + 0.5
+    y = (np.arange(size[1], dtype=np.float64) + 0.5)[:, None]
+    xin = a * x + b * y + c
+    yin = d * x + e * y + f
+    return ((xin >= 0) & (xin < width) & (yin >= 0) & (yin < height)).astype(np.uint8)
+
+
+def _rotate_plan(width, height, angle):
+    forward, (canvas_w, canvas_h) = rotate_expand_plan(width, height, angle)
+    # 白いキャンバスの外側（回転による四隅）は黒になる
+    mask = _coverage_mask((canvas_w, canvas_h), _pil_rotate_inverse(canvas_w, canvas_h, angle), canvas_w, canvas_h)
+    return WarpPlan((canvas_w, canvas_h), forward, mask, cv2.BORDER_CONSTANT, WHITE)
+
+
+def _shear_plan(width, height, angle_degrees, direction, shear_direction):
+    forward, size = shear_plan(width, height, angle_degrees, direction, shear_direction)
+    data, _ = _shear_inverse(width, height, angle_degrees, direction, shear_direction)
+    # 入力画像の外側は黒になり、内側の縁は端の画素で補間する
+    mask = _coverage_mask(size, data, width, height)
+    return WarpPlan(size, forward, mask)
+
+
+def _rotate_shear_plan(width, height, angle, shear_angle, direction, shear_direction):
+    rotate, (canvas_w, canvas_h) = rotate_expand_plan(width, height, angle)
+    shear, size = shear_plan(canvas_w, canvas_h, shear_angle, direction, shear_direction)
+    data, _ = _shear_inverse(canvas_w, canvas_h, shear_angle, direction, shear_direction)
+    # シアーではみ出した領域と、回転による四隅の両方を黒で塗る。四隅の縁は元の処理では
+    # シアーの補間でぼけるため、回転した四隅のマスクを同じくPILでシアーし、半分以上が黒になる画素を黒とする
+    canvas = _coverage_mask((canvas_w, canvas_h), _pil_rotate_inverse(canvas_w, canvas_h, angle), canvas_w, canvas_h)
+    sheared = Image.fromarray(canvas * np.uint8(255)).transform(size, Image.Transform.AFFINE, data,
+                                                                  resample=Image.Resampling.BICUBIC)
+    mask = (np.asarray(sheared) >= 128).astype(np.uint8)
+    return WarpPlan(size, shear @ rotate, mask, cv2.BORDER_CONSTANT, WHITE)
+
+
+def rotate_expand(image, angle):
+    """
+    edit.py の rotate_image(expand=True) と同じく、白いキャンバスの中央に画像を貼り付けて
+    回転した画像を1回の再サンプリングで求めます。
+
+    :return: 回転後の画像（RGB）
+    """
+    image = _as_rgb(image)
+    height, width = image.shape[:2]
+    plan = plans.get(('rotate', width, height, angle), lambda: _rotate_plan(width, height, angle))
+    return plan.apply(image)
+
+
+def shear(image, angle_degrees, direction='horizontal', shear_direction='right'):
+    """
+    edit.py の shear_image_with_angle と同じシアー変換を行います。チャンネル数は入力と同じです。
+    """
+    height, width = image.shape[:2]
+    key = ('shear', width, height, angle_degrees, direction, shear_direction)
+    plan = plans.get(key, lambda: _shear_plan(width, height, angle_degrees, direction, shear_direction))
+    return plan.apply(image)
+
+
+def rotate_shear(image, angle, shear_angle, direction='horizontal', shear_direction='right'):
+    """
+    rotate_image(image, angle) に続けて shear_image_with_angle を適用した結果を、
+    回転とシアーを合成した1回の再サンプリングで求めます。
+
+    白いキャンバスの余白と、回転・シアーではみ出した黒い領域も元の処理と同じように再現します。
+
+    :param image: 入力画像（numpy配列）
+    :param angle: 回転角度（度数法で指定）
+    :param shear_angle: シアー角度（度数法で指定）
+    :param direction: シアーの方向 ('horizontal' または 'vertical')
+    :param shear_direction: シアーの向き ('right' または 'left')
+    :return: 変換後の画像（RGB）
+    """
+    image = _as_rgb(image)
+    height, width = image.shape[:2]
+    key = ('rotate_shear', width, height, angle, shear_angle, direction, shear_direction)
+    plan = plans.get(key, lambda: _rotate_shear_plan(width, height, angle, shear_angle, direction, shear_direction))
+    return plan.apply(image)
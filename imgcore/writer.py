@@ -0,0 +1,427 @@
+import os
+import re
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+import numpy as np
+from imgcore.instrument import stage
+from imgcore.lazy import lazy_import
+
+io = lazy_import('skimage.io')
+Image = lazy_import('PIL.Image')
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+INCH_PER_METER = 0.0254
+
+# PILで直接書き出せる (dtype, チャンネル数) の組み合わせ
+_PIL_MODES = {
+    (np.dtype(np.uint8), 1): 'L',
+    (np.dtype(np.uint8), 3): 'RGB',
+    (np.dtype(np.uint8), 4): 'RGBA',
+    (np.dtype(np.uint16), 1): 'I;16',
+}
+
+
+def _pil_mode(image):
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    return _PIL_MODES.get((image.dtype, channels))
+
+
+# 出力形式と拡張子
+FORMATS = {
+    'png': '.png',
+    'tiff': '.tif',
+    'bmp': '.bmp',
+    'qoi': '.qoi',
+    'npy': '.npy',
+}
+# DPIを書き込める拡張子
+_DPI_EXTS = ('.png', '.tif', '.tiff', '.bmp')
+# DPIを書き込めない形式（.npy / .qoi）のDPIは、画像のファイル名にこの拡張子を付けたファイルに記録する
+DPI_SIDECAR_EXT = '.dpi'
+
+# PNGの行フィルタ。auto はPILに任せる（行ごとに適応的に選択）
+PNG_FILTERS = ('auto', 'none', 'sub', 'up')
+_PNG_FILTER_TYPES = {'none': 0, 'sub': 1, 'up': 2}
+
+# zlibの圧縮戦略
+ZLIB_STRATEGIES = {
+    'default': zlib.Z_DEFAULT_STRATEGY,
+    'filtered': zlib.Z_FILTERED,
+    'huffman': zlib.Z_HUFFMAN_ONLY,
+    'rle': zlib.Z_RLE,
+    'fixed': zlib.Z_FIXED,
+}
+
+
+def add_encoder_arguments(parser):
+    # 出力形式とPNGのエンコード設定のコマンドライン引数を追加
+    parser.add_argument('--format', choices=list(FORMATS), default=None,
+                        help='出力形式（npy / tiff / bmp / qoi は非圧縮または高速な中間形式。qoi は Pillow 9.5 以降が必要）')
+    parser.add_argument('--compress-level', type=int, choices=range(0, 10), default=None, metavar='0-9',
+                        help='PNGの圧縮レベル（0は無圧縮、9は最大圧縮。既定は6）')
+    parser.add_argument('--png-filter', choices=PNG_FILTERS, default=None,
+                        help='PNGの行フィルタ（バーコードのように行が揃った画像は up が高速で小さい）')
+    parser.add_argument('--zlib-strategy', choices=list(ZLIB_STRATEGIES), default=None,
+                        help='PNGのzlib圧縮戦略（rle は高速）')
+    return parser
+
+
+def encoder_settings(args, defaults=None):
+    """
+    コマンドライン引数とパイプライン定義の encoder 設定から、出力形式と
+    write_image に渡すオプションを求めます。コマンドライン引数が優先されます。
+
+    :param args: add_encoder_arguments で追加した引数の解析結果（Noneの場合は defaults だけを使う）
+    :param defaults: {'format', 'compress_level', 'filter', 'strategy'} の辞書
+    :return: (出力形式（指定がなければNone）, オプションの辞書)
+    :raises ValueError: 設定が正しくないか、インストールされたPillowで出力形式を書き込めない場合
+    """
+    settings = dict(defaults or {})
+    if args is not None:
+        for key, value in (('format', args.format), ('compress_level', args.compress_level),
+                           ('filter', args.png_filter), ('strategy', args.zlib_strategy)):
+            if value is not None:
+                settings[key] = value
+    fmt = settings.pop('format', None)
+    if fmt is not None and fmt not in FORMATS:
+        raise ValueError(f'Invalid format: {fmt}')
+    # QOIの書き込みは Pillow 9.5 以降のみ対応（全てのファイルで失敗する前に止める）
+    if fmt == 'qoi' and not _can_save('QOI'):
+        raise ValueError('This version of Pillow cannot write QOI images (Pillow 9.5 or later is required)')
+    if settings.get('filter', 'auto') not in PNG_FILTERS:
+        raise ValueError(f'Invalid PNG filter: {settings["filter"]}')
+    if settings.get('strategy', 'default') not in ZLIB_STRATEGIES:
+        raise ValueError(f'Invalid zlib strategy: {settings["strategy"]}')
+    return fmt, settings
+
+
+def _can_save(format_name):
+    # 保存できる形式はプラグインを読み込むまで分からない
+    Image.init()
+    return format_name in Image.SAVE
+
+
+def _pil_params(ext, dpi, options):
+    params = {}
+    if dpi is not None and ext in _DPI_EXTS:
+        params['dpi'] = (dpi, dpi)
+    if ext == '.png':
+        if 'compress_level' in options:
+            params['compress_level'] = options['compress_level']
+        if 'strategy' in options:
+            params['compress_type'] = ZLIB_STRATEGIES[options['strategy']]
+    elif ext in ('.tif', '.tiff'):
+        params['compression'] = 'raw'
+    elif ext == '.qoi' and not _can_save('QOI'):
+        raise ValueError('This version of Pillow cannot write QOI images')
+    return params
+
+
+@contextmanager
+def atomic_output(file_path):
+    """
+    同じディレクトリの一時ファイルのパスを返し、with文を抜けたときに file_path に置き換えます（os.replace）。
+
+    書き込み中に中断しても file_path に途中までのファイルが残ることはありません。
+    例外が発生した場合は一時ファイルを削除します。一時ファイルは形式の判定のため
+    file_path と同じ拡張子にします。
+    """
+    dir_path, name = os.path.split(file_path)
+    # 並列に書き込むプロセス・スレッドで重ならない名前にする（パーミッションは通常の保存と同じ）
+    tmp_name = f'.{name}.{os.getpid()}-{threading.get_ident()}.tmp{os.path.splitext(name)[1]}'
+    tmp_path = os.path.join(dir_path, tmp_name)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# atomic_output の一時ファイル名（. + ファイル名 + . + プロセスID-スレッドID + .tmp + 拡張子）
+_TEMP_NAME = re.compile(r'\..+\.(\d+)-\d+\.tmp(\.[^.]*)?\Z')
+
+
+def remove_stale_temporaries(dir_path):
+    """
+    中断した処理が残した atomic_output の一時ファイルを削除し、削除した数を返します。
+
+    同じ出力先に同時に複数の処理を実行しない前提で、このプロセス以外の一時ファイルを全て削除します。
+    """
+    removed = 0
+    pid = os.getpid()
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            match = _TEMP_NAME.match(entry.name)
+            if match is None or int(match.group(1)) == pid or not entry.is_file():
+                continue
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                continue
+    return removed
+
+
+def write_image(file_path, image, dpi=None, options=None):
+    """
+    画像を1回のエンコードで最終ファイル名に保存します。
+
+    DPIの指定がある場合はエンコード時にpHYsチャンクへ書き込むため、
+    保存後に再読み込み・再エンコード・リネームする必要はありません。
+    形式は拡張子で決まり、.npy は配列をそのまま保存します。DPIを書き込めない形式（.npy / .qoi）は
+    DPIを file_path + '.dpi' に記録し、convert_to_png で引き継ぎます。
+    一時ファイルに書いてから置き換えるため、中断しても途中までのファイルは残りません。
+
+    :param file_path: 出力先のファイルパス（最終的なファイル名）
+    :param image: 保存する画像（numpy配列）
+    :param dpi: 書き込むDPI（Noneの場合は書き込まない）
+    :param options: PNGのエンコード設定 {'compress_level', 'filter', 'strategy'}
+    """
+    with atomic_output(file_path) as tmp_path:
+        _write_image(tmp_path, image, dpi, options or {})
+    if os.path.splitext(file_path)[1].lower() not in _DPI_EXTS:
+        write_dpi_sidecar(file_path, dpi)
+
+
+def write_dpi_sidecar(file_path, dpi):
+    # DPIを file_path + '.dpi' に記録する（Noneの場合は以前の記録を削除する）
+    sidecar = file_path + DPI_SIDECAR_EXT
+    if dpi is None:
+        if os.path.exists(sidecar):
+            os.remove(sidecar)
+        return
+    with atomic_output(sidecar) as tmp_path:
+        with open(tmp_path, 'w', encoding='ascii') as f:
+            f.write(f'{dpi}\n')
+
+
+def read_dpi_sidecar(file_path):
+    # write_dpi_sidecar で記録したDPI（記録がなければNone）
+    try:
+        with open(file_path + DPI_SIDECAR_EXT, encoding='ascii') as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_image(file_path, image, dpi, options):
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == '.npy':
+        with stage('encode') as event:
+            np.save(file_path, np.ascontiguousarray(image))
+            event['bytes_written'] = os.path.getsize(file_path)
+        return
+
+    if _pil_mode(image) is None:
+        # PILで扱えない形式はskimageに任せ、DPIはチャンクだけ書き換える
+        with stage('encode') as event:
+            io.imsave(file_path, image)
+            event['bytes_written'] = os.path.getsize(file_path)
+        if dpi is not None:
+            set_dpi(file_path, dpi)
+        return
+
+    if image.ndim == 3 and image.shape[2] == 1:
+        image = image[:, :, 0]
+    with stage('encode') as event:
+        if ext == '.png' and options.get('filter', 'auto') != 'auto':
+            encode_png(file_path, image, dpi, options)
+        else:
+            Image.fromarray(image).save(file_path, **_pil_params(ext, dpi, options))
+        event['bytes_written'] = os.path.getsize(file_path)
+
+
+def encode_png(file_path, image, dpi=None, options=None, strip_rows=256):
+    """
+    行フィルタとzlibの圧縮戦略を指定してPNGを保存します。
+
+    :param options: {'compress_level', 'filter', 'strategy'}
+    """
+    options = options or {}
+    height, width = image.shape[:2]
+    channels = image.shape[2] if image.ndim == 3 else 1
+    with PngStreamWriter(file_path, width, height, channels, image.dtype, dpi,
+                         compress_level=options.get('compress_level', 6),
+                         png_filter=options.get('filter', 'none'),
+                         strategy=options.get('strategy', 'default')) as writer:
+        for y in range(0, height, strip_rows):
+            writer.write_rows(image[y:y + strip_rows])
+
+
+def convert_to_png(src_path, dst_path, dpi=None, options=None):
+    """
+    中間形式（.npy / .tif / .bmp / .qoi など）の画像をPNGに変換します。
+
+    :param dpi: 書き込むDPI（Noneの場合は変換元のDPIを引き継ぐ。.npy / .qoi は write_image が記録したDPI）
+    """
+    if dpi is None:
+        dpi = read_dpi_sidecar(src_path)
+    if os.path.splitext(src_path)[1].lower() == '.npy':
+        image = np.load(src_path)
+    else:
+        with Image.open(src_path) as src:
+            if dpi is None and 'dpi' in src.info:
+                dpi = round(src.info['dpi'][0])
+            image = np.asarray(src)
+    write_image(dst_path, image, dpi, options)
+
+
+def _chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def _phys_chunk(dpi):
+    ppm = int(dpi / INCH_PER_METER + 0.5)
+    data = struct.pack('>IIB', ppm, ppm, 1)
+    return _chunk(b'pHYs', data)
+
+
+def _png_chunks(f):
+    # (オフセット, チャンク種別, データ長) を順に返す
+    offset = len(PNG_SIGNATURE)
+    f.seek(offset)
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        length, chunk_type = struct.unpack('>I4s', header)
+        yield offset, chunk_type, length
+        offset += 12 + length
+        f.seek(offset)
+
+
+def set_png_dpi(file_path, dpi):
+    """
+    PNGのpHYsチャンクだけを書き換えてDPIを変更します。画素データはデコードしません。
+
+    既存のpHYsチャンクがあればその場で上書きし、無ければIDATの直前に挿入します。
+
+    :param file_path: PNGファイルのパス
+    :param dpi: 書き込むDPI
+    """
+    chunk = _phys_chunk(dpi)
+    with open(file_path, 'r+b') as f:
+        if f.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+            raise ValueError(f'Not a PNG file: {file_path}')
+        insert_at = None
+        for offset, chunk_type, length in _png_chunks(f):
+            if chunk_type == b'pHYs' and length == 9:
+                f.seek(offset)
+                f.write(chunk)
+                return
+            if chunk_type == b'IDAT':
+                insert_at = offset
+                break
+        if insert_at is None:
+            raise ValueError(f'IDAT chunk not found: {file_path}')
+        f.seek(insert_at)
+        rest = f.read()
+        f.seek(insert_at)
+        f.write(chunk + rest)
+
+
+def set_dpi(file_path, dpi):
+    # DPIを変更する（PNGはチャンクの書き換えのみ、それ以外は再保存）
+    with stage('dpi_rewrite'):
+        if os.path.splitext(file_path)[1].lower() == '.png':
+            set_png_dpi(file_path, dpi)
+        else:
+            image = Image.open(file_path)
+            image.load()
+            image.save(file_path, dpi=(dpi, dpi))
+
+
+# チャンネル数からPNGのカラータイプへの対応
+_PNG_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
+
+
+class PngStreamWriter:
+    """
+    行単位で画素を受け取り、全体をメモリに保持せずにPNGを書き出すエンコーダ。
+
+    with文で使用し、write_rows で上から順に行を書き込みます。
+    """
+
+    IDAT_SIZE = 1 << 16
+
+    def __init__(self, file_path, width, height, channels, dtype=np.uint8, dpi=None, compress_level=6,
+                 png_filter='none', strategy='default'):
+        dtype = np.dtype(dtype)
+        if dtype not in (np.dtype(np.uint8), np.dtype(np.uint16)):
+            raise ValueError(f'Unsupported dtype for PNG: {dtype}')
+        if channels not in _PNG_COLOR_TYPES:
+            raise ValueError(f'Unsupported number of channels for PNG: {channels}')
+        self.file_path = file_path
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.dtype = dtype
+        self.rows_written = 0
+        if png_filter not in _PNG_FILTER_TYPES:
+            raise ValueError(f'Unsupported PNG filter for streaming: {png_filter}')
+        self.filter = png_filter
+        # フィルタの計算に使う1画素のバイト数と直前の行
+        self._bpp = channels * dtype.itemsize
+        self._previous = np.zeros(width * self._bpp, dtype=np.uint8)
+        self._compressor = zlib.compressobj(compress_level, zlib.DEFLATED, zlib.MAX_WBITS, 8,
+                                            ZLIB_STRATEGIES[strategy])
+        self._buffer = []
+        self._buffered = 0
+        self._file = open(file_path, 'wb')
+        ihdr = struct.pack('>IIBBBBB', width, height, dtype.itemsize * 8, _PNG_COLOR_TYPES[channels], 0, 0, 0)
+        self._file.write(PNG_SIGNATURE + _chunk(b'IHDR', ihdr))
+        if dpi is not None:
+            self._file.write(_phys_chunk(dpi))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+    def _write_idat(self, data, flush=False):
+        if data:
+            self._buffer.append(data)
+            self._buffered += len(data)
+        if self._buffered >= self.IDAT_SIZE or (flush and self._buffered):
+            self._file.write(_chunk(b'IDAT', b''.join(self._buffer)))
+            self._buffer = []
+            self._buffered = 0
+
+    def write_rows(self, rows):
+        # rows: (行数, 幅[, チャンネル数]) の配列
+        rows = rows.reshape(rows.shape[0], self.width * self.channels)
+        if rows.dtype != self.dtype:
+            raise ValueError(f'dtype mismatch: {rows.dtype} != {self.dtype}')
+        if self.rows_written + rows.shape[0] > self.height:
+            raise ValueError('Too many rows written')
+        data = np.ascontiguousarray(rows.astype(self.dtype.newbyteorder('>'), copy=False)).view(np.uint8)
+        # 各行の先頭にフィルタ種別を付ける（フィルタはバイト単位で、桁あふれは256で折り返す）
+        raw = np.empty((data.shape[0], 1 + data.shape[1]), dtype=np.uint8)
+        raw[:, 0] = _PNG_FILTER_TYPES[self.filter]
+        if self.filter == 'sub':
+            raw[:, 1:1 + self._bpp] = data[:, :self._bpp]
+            np.subtract(data[:, self._bpp:], data[:, :-self._bpp], out=raw[:, 1 + self._bpp:])
+        elif self.filter == 'up':
+            np.subtract(data[:1], self._previous, out=raw[:1, 1:])
+            np.subtract(data[1:], data[:-1], out=raw[1:, 1:])
+            self._previous = data[-1].copy()
+        else:
+            raw[:, 1:] = data
+        self._write_idat(self._compressor.compress(raw.tobytes()))
+        self.rows_written += rows.shape[0]
+
+    def close(self):
+        if self.rows_written != self.height:
+            self._file.close()
+            raise ValueError(f'Expected {self.height} rows, got {self.rows_written}')
+        self._write_idat(self._compressor.flush(), flush=True)
+        self._file.write(_chunk(b'IEND', b''))
+        self._file.close()
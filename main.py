@@ -1,88 +1,128 @@
 import os
-import cv2
-import numpy as np
-from skimage import io
-from PIL import Image
-
-def file_list(dir_path, ext=None):
-    # ディレクトリ内のファイル一覧を取得
-    files = os.listdir(dir_path)
-    files = [f for f in files if os.path.isfile(os.path.join(dir_path, f))]
-    if ext is not None:
-        files = [f for f in files if os.path.splitext(f)[1] == ext]
-    return files
-
-def read_image(file_path):
-    # 画像を読み込む
-    image = io.imread(file_path)
-    return image
-
-def rgba2rgb(image_rgba):
-    # RGBA画像をRGBに変換
-    if image_rgba.shape[-1] == 4:
-        image_rgb = image_rgba[:, :, :3]
-    else:
-        image_rgb = image_rgba
-    return image_rgb
-
-def save_image(file_path, image):
-    # 画像を保存
-    io.imsave(file_path, image)
-
-def dpi_change(file_path, dpi):
-    # DPIを変更して保存
-    image = Image.open(file_path)
-    image.save(file_path, dpi=(dpi, dpi))
-
-def image_info(image):
-    return {
-        'shape': image.shape,
-        'dtype': image.dtype,
-        'min': image.min(),
-        'max': image.max()
-    }
-
-def rename_file(file_path, new_name):
-    # ファイル名を変更
-    os.rename(file_path, new_name)
-
-def bicubic_interpolation(image, scale):
-    height, width = image.shape[:2]
-    new_dimensions = (int(width * scale), int(height * scale))
-    return cv2.resize(image, new_dimensions, interpolation=cv2.INTER_CUBIC)
+import argparse
+from functools import partial
+from imgcore.writer import add_encoder_arguments, encoder_settings, FORMATS
+from imgcore.scan import add_scan_arguments, scan_options
+from imgcore.alpha import WHITE, add_alpha_arguments, parse_background
+from imgcore.core import file_list, decode_image, read_image, rgba2rgb, save_image, image_info, resize_image, resize_canvas
+from imgcore.batch import add_batch_arguments, run_files
+from imgcore.instrument import stage
+from imgcore.encoder import EncoderPool
+from imgcore.rawio import map_rgb
+from imgcore import batched
+from imgcore.tiles import DEFAULT_STRIP_ROWS, open_strips, CanvasStrips, ChannelStrips, ResizeStrips, stream_to_png
+
+def process_file_streaming(file_path, output_path, dpi, dpi2, scale, xmargin, ymargin, output_ext, strip_rows, options=None,
+                           background=WHITE):
+    # 短冊単位で読み込み・余白追加・拡大・書き出しを行い、画像全体をメモリに展開しない
+    outputs = []
+    source = open_strips(file_path)
+    # process_file と同じく、RGBの入力は余白を背景色で、RGBAの入力は透明で塗ってから背景色に合成する
+    color = (255, 255, 255, 0) if source.shape[2] == 4 else background or WHITE
+    image_rgb = ChannelStrips(CanvasStrips(source, ymargin, xmargin, ymargin, xmargin, color=color),
+                              background=background)
+    new_name = os.path.splitext(output_path)[0] + f'_{image_rgb.dtype}_{dpi}dpi{output_ext}'
+    stream_to_png(image_rgb, new_name, dpi, strip_rows, options)
+    outputs.append(new_name)
+
+    resized_image = ResizeStrips(image_rgb, scale, method='nearest')
+    new_name = os.path.splitext(output_path)[0] + f'_{resized_image.dtype}_{dpi2}dpi{output_ext}'
+    stream_to_png(resized_image, new_name, dpi2, strip_rows, options)
+    outputs.append(new_name)
+    return outputs
+
+def process_file(f, dir_path, output_dir, dpi, dpi2, scale, xmargin, ymargin, output_ext, strip_rows=None, encoders=0,
+                 options=None, background=WHITE):
+    # 1ファイル分の処理を行い、出力したファイルパスのリストを返す
+    print('Processing:', f)
+    file_path = os.path.join(dir_path, f)
+    output_path = os.path.join(output_dir, os.path.splitext(f)[0] + output_ext)
+    if strip_rows:
+        return process_file_streaming(file_path, output_path, dpi, dpi2, scale, xmargin, ymargin, output_ext, strip_rows,
+                                      options, background)
+    outputs = []
+    # 96dpiの画像のエンコード中に300dpiへの拡大を進める
+    with EncoderPool(encoders, save=partial(save_image, options=options)) as pool:
+        with stage('decode') as event:
+            # アルファが全て不透明でない場合は合成が必要なので、通常の読み込みにする
+            image_rgb = map_rgb(file_path, require_opaque=background is not None)
+            if image_rgb is not None:
+                event['bytes_read'] = image_rgb.nbytes
+            else:
+                # メモリマップできなかった場合も、読み込みは1回の decode として記録する
+                image = decode_image(file_path)
+                event['bytes_read'] = os.path.getsize(file_path)
+        if image_rgb is not None:
+            # BMPはメモリマップしたRGBのビューに直接余白を追加する（入力画像のコピーを作らない）
+            with stage('canvas'):
+                image_rgb = resize_canvas(image_rgb, ymargin, xmargin, ymargin, xmargin, color=background or WHITE)
+        else:
+            with stage('canvas'):
+                image = resize_canvas(image, ymargin, xmargin, ymargin, xmargin, color=(255, 255, 255, 0))
+            with stage('alpha_strip'):
+                image_rgb = rgba2rgb(image, background)
+        info = image_info(image_rgb)
+        new_name = os.path.splitext(output_path)[0] + f'_{info["dtype"]}_{dpi}dpi{output_ext}'
+        pool.submit(new_name, image_rgb, dpi)
+        outputs.append(new_name)
 
-def bilinear_interpolation(image, scale):
-    height, width = image.shape[:2]
-    new_dimensions = (int(width * scale), int(height * scale))
-    return cv2.resize(image, new_dimensions, interpolation=cv2.INTER_LINEAR)
+        # resized_output_path = os.path.join(output_dir, os.path.splitext(f)[0] + f'_bicubic_{scale}x{output_ext}')
+        # resized_image = resize_image(image_rgb, scale, method='bicubic')
+        # info = image_info(resized_image)
+        # new_name = os.path.splitext(resized_output_path)[0] + f'_{info["dtype"]}_{dpi2}dpi{output_ext}'
+        # pool.submit(new_name, resized_image, dpi2)
 
-def nearest_interpolation(image, scale):
-    height, width = image.shape[:2]
-    new_dimensions = (int(width * scale), int(height * scale))
-    return cv2.resize(image, new_dimensions, interpolation=cv2.INTER_NEAREST)
+        # resized_output_path = os.path.join(output_dir, os.path.splitext(f)[0] + f'_bilinear_{scale}x{output_ext}')
+        # resized_image = resize_image(image_rgb, scale, method='bilinear')
+        # info = image_info(resized_image)
+        # new_name = os.path.splitext(resized_output_path)[0] + f'_{info["dtype"]}_{dpi2}dpi{output_ext}'
+        # pool.submit(new_name, resized_image, dpi2)
 
-def resize_image(image, scale, method='bicubic'):
-    # 画像を拡大する
-    if method == 'bicubic':
-        return bicubic_interpolation(image, scale)
-    elif method == 'bilinear':
-        return bilinear_interpolation(image, scale)
-    elif method == 'nearest':
-        return nearest_interpolation(image, scale)
-    else:
-        raise ValueError('Invalid method')
-    
-def resize_canvas(image, tmargin, lmargin, bmargin, rmargin, color=(0, 0, 0, 0)):
-    # キャンバスをリサイズ
-    height, width, channels = image.shape
-    new_height = height + tmargin + bmargin
-    new_width = width + lmargin + rmargin
-    new_image = np.zeros((new_height, new_width, channels), dtype=image.dtype)
-    new_image[:, :] = color
-    new_image[tmargin:tmargin + height, lmargin:lmargin + width] = image
-    return new_image
+        # resized_output_path = os.path.join(output_dir, os.path.splitext(f)[0] + f'_nearest_{scale}x{output_ext}')
+        resized_output_path = os.path.join(output_dir, os.path.splitext(f)[0] + f'{output_ext}')
+        with stage('resize'):
+            resized_image = resize_image(image_rgb, scale, method='nearest')
+        info = image_info(resized_image)
+        new_name = os.path.splitext(resized_output_path)[0] + f'_{info["dtype"]}_{dpi2}dpi{output_ext}'
+        pool.submit(new_name, resized_image, dpi2)
+        outputs.append(new_name)
+    return outputs
+
+def process_batch(files, dir_path, output_dir, dpi, dpi2, scale, xmargin, ymargin, output_ext, encoders=0,
+                  options=None, background=WHITE):
+    # 同じサイズの画像をまとめて処理し、ファイル名から出力したファイルパスのリストへの辞書を返す
+    outputs = {}
+    with EncoderPool(encoders, save=partial(save_image, options=options)) as pool:
+        groups = batched.group_by_shape(files, lambda f: read_image(os.path.join(dir_path, f)), len(files))
+        for names, stack in groups:
+            print('Processing:', ', '.join(names))
+            with stage('canvas'):
+                stack = batched.resize_canvas(stack, ymargin, xmargin, ymargin, xmargin, color=(255, 255, 255, 0))
+            with stage('alpha_strip'):
+                stack_rgb = batched.rgba2rgb(stack, background)
+            with stage('resize'):
+                resized_stack = batched.resize_nearest(stack_rgb, scale)
+            infos = batched.image_info(stack_rgb)
+            resized_infos = batched.image_info(resized_stack)
+            for i, f in enumerate(names):
+                stem = os.path.join(output_dir, os.path.splitext(f)[0])
+                new_name = stem + f'_{infos[i]["dtype"]}_{dpi}dpi{output_ext}'
+                resized_name = stem + f'_{resized_infos[i]["dtype"]}_{dpi2}dpi{output_ext}'
+                pool.submit(new_name, stack_rgb[i], dpi)
+                pool.submit(resized_name, resized_stack[i], dpi2)
+                outputs[f] = [new_name, resized_name]
+    return outputs
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='画像に余白を追加し、DPIを指定して保存します。')
+    parser.add_argument('--stream', nargs='?', type=int, const=DEFAULT_STRIP_ROWS, default=None, metavar='ROWS',
+                        help='画像全体を読み込まず、指定した行数ずつ処理する（大きなスキャン画像向け）')
+    add_batch_arguments(parser)
+    add_scan_arguments(parser)
+    add_encoder_arguments(parser)
+    add_alpha_arguments(parser)
+    args = parser.parse_args(argv)
 
-def main():
     dpi = 96  # DPIを指定
     dpi2 = 300  # DPIを指定
     ext = '.bmp'  # 対象の拡張子を指定
@@ -90,52 +130,35 @@ def main():
     scale = dpi2 / dpi  # 拡大率を計算
     xmargin = 10  # キャンバスの余白を指定
     ymargin = 10  # キャンバスの余白を指定
+    try:
+        output_format, options = encoder_settings(args)
+    except ValueError as e:
+        parser.error(str(e))
+    background = parse_background(args.background)
+    if output_format is not None:
+        output_ext = FORMATS[output_format]
+    if args.stream and output_ext != '.png':
+        parser.error('--stream はPNG出力のみ対応しています')
 
     # ファイル一覧を取得
     dir_path = 'input'
-    files = file_list(dir_path, ext)
+    files = file_list(dir_path, ext, **scan_options(args))
 
     output_dir = 'output'
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    for f in files:
-        print('Processing:', f)
-        file_path = os.path.join(dir_path, f)
-        output_path = os.path.join(output_dir, os.path.splitext(f)[0] + output_ext)
-        image = read_image(file_path)
-        image = resize_canvas(image, ymargin, xmargin, ymargin, xmargin, color=(255, 255, 255, 0))
-        image_rgb = rgba2rgb(image)
-        save_image(output_path, image_rgb)
-        dpi_change(output_path, dpi)
-        info = image_info(image_rgb)
-        new_name = os.path.splitext(output_path)[0] + f'_{info["dtype"]}_{dpi}dpi{output_ext}'
-        rename_file(output_path, new_name)
-
-        # resized_output_path = os.path.join(output_dir, os.path.splitext(f)[0] + f'_bicubic_{scale}x{output_ext}')
-        # resized_image = resize_image(image_rgb, scale, method='bicubic')
-        # save_image(resized_output_path, resized_image)
-        # info = image_info(resized_image)
-        # dpi_change(resized_output_path, dpi2)
-        # new_name = os.path.splitext(resized_output_path)[0] + f'_{info["dtype"]}_{dpi2}dpi{output_ext}'
-        # rename_file(resized_output_path, new_name)
-
-        # resized_output_path = os.path.join(output_dir, os.path.splitext(f)[0] + f'_bilinear_{scale}x{output_ext}')
-        # resized_image = resize_image(image_rgb, scale, method='bilinear')
-        # save_image(resized_output_path, resized_image)
-        # info = image_info(resized_image)
-        # dpi_change(resized_output_path, dpi2)
-        # new_name = os.path.splitext(resized_output_path)[0] + f'_{info["dtype"]}_{dpi2}dpi{output_ext}'
-        # rename_file(resized_output_path, new_name)
-
-        # resized_output_path = os.path.join(output_dir, os.path.splitext(f)[0] + f'_nearest_{scale}x{output_ext}')
-        resized_output_path = os.path.join(output_dir, os.path.splitext(f)[0] + f'{output_ext}')
-        resized_image = resize_image(image_rgb, scale, method='nearest')
-        save_image(resized_output_path, resized_image)
-        info = image_info(resized_image)
-        dpi_change(resized_output_path, dpi2)
-        new_name = os.path.splitext(resized_output_path)[0] + f'_{info["dtype"]}_{dpi2}dpi{output_ext}'
-        rename_file(resized_output_path, new_name)
+    task = partial(process_file, dir_path=dir_path, output_dir=output_dir, dpi=dpi, dpi2=dpi2,
+                   scale=scale, xmargin=xmargin, ymargin=ymargin, output_ext=output_ext,
+                   strip_rows=args.stream, encoders=args.encoders, options=options, background=background)
+    params = {'dpi': dpi, 'dpi2': dpi2, 'scale': scale, 'xmargin': xmargin, 'ymargin': ymargin, 'output_ext': output_ext,
+              'encoder': options, 'background': background}
+    batch_task = None
+    if not args.stream:
+        batch_task = partial(process_batch, dir_path=dir_path, output_dir=output_dir, dpi=dpi, dpi2=dpi2,
+                             scale=scale, xmargin=xmargin, ymargin=ymargin, output_ext=output_ext,
+                             encoders=args.encoders, options=options, background=background)
+    return run_files(task, files, dir_path, output_dir, params, args, batch_task)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
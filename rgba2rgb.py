@@ -1,88 +1,32 @@
 import os
-import cv2
-import numpy as np
-from skimage import io
-from PIL import Image
+import argparse
+from functools import partial
+from imgcore.writer import add_encoder_arguments, encoder_settings, FORMATS
+from imgcore.scan import add_scan_arguments, scan_options
+from imgcore.alpha import WHITE, add_alpha_arguments, parse_background
+from imgcore.batch import add_batch_arguments, run_files
+from imgcore.instrument import stage
+from imgcore.core import file_list, read_image, rgba2rgb, save_image
+
+def process_file(f, dir_path, output_dir, dpi2, output_ext, options=None, background=WHITE):
+    # 1ファイル分の処理を行い、出力したファイルパスのリストを返す
+    print('Processing:', f)
+    file_path = os.path.join(dir_path, f)
+    output_path = os.path.join(output_dir, os.path.splitext(f)[0] + output_ext)
+    image = read_image(file_path)
+    with stage('alpha_strip'):
+        image_rgb = rgba2rgb(image, background)
+    save_image(output_path, image_rgb, dpi2, options)
+    return [output_path]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='RGBA画像をRGBに変換して保存します。')
+    add_batch_arguments(parser)
+    add_scan_arguments(parser)
+    add_encoder_arguments(parser)
+    add_alpha_arguments(parser)
+    args = parser.parse_args(argv)
 
-def file_list(dir_path, ext=None):
-    # ディレクトリ内のファイル一覧を取得
-    files = os.listdir(dir_path)
-    files = [f for f in files if os.path.isfile(os.path.join(dir_path, f))]
-    if ext is not None:
-        files = [f for f in files if os.path.splitext(f)[1] == ext]
-    return files
-
-def read_image(file_path):
-    # 画像を読み込む
-    image = io.imread(file_path)
-    return image
-
-def rgba2rgb(image_rgba):
-    # RGBA画像をRGBに変換
-    if image_rgba.shape[-1] == 4:
-        image_rgb = image_rgba[:, :, :3]
-    else:
-        image_rgb = image_rgba
-    return image_rgb
-
-def save_image(file_path, image):
-    # 画像を保存
-    io.imsave(file_path, image)
-
-def dpi_change(file_path, dpi):
-    # DPIを変更して保存
-    image = Image.open(file_path)
-    image.save(file_path, dpi=(dpi, dpi))
-
-def image_info(image):
-    return {
-        'shape': image.shape,
-        'dtype': image.dtype,
-        'min': image.min(),
-        'max': image.max()
-    }
-
-def rename_file(file_path, new_name):
-    # ファイル名を変更
-    os.rename(file_path, new_name)
-
-def bicubic_interpolation(image, scale):
-    height, width = image.shape[:2]
-    new_dimensions = (int(width * scale), int(height * scale))
-    return cv2.resize(image, new_dimensions, interpolation=cv2.INTER_CUBIC)
-
-def bilinear_interpolation(image, scale):
-    height, width = image.shape[:2]
-    new_dimensions = (int(width * scale), int(height * scale))
-    return cv2.resize(image, new_dimensions, interpolation=cv2.INTER_LINEAR)
-
-def nearest_interpolation(image, scale):
-    height, width = image.shape[:2]
-    new_dimensions = (int(width * scale), int(height * scale))
-    return cv2.resize(image, new_dimensions, interpolation=cv2.INTER_NEAREST)
-
-def resize_image(image, scale, method='bicubic'):
-    # 画像を拡大する
-    if method == 'bicubic':
-        return bicubic_interpolation(image, scale)
-    elif method == 'bilinear':
-        return bilinear_interpolation(image, scale)
-    elif method == 'nearest':
-        return nearest_interpolation(image, scale)
-    else:
-        raise ValueError('Invalid method')
-    
-def resize_canvas(image, tmargin, lmargin, bmargin, rmargin, color=(0, 0, 0, 0)):
-    # キャンバスをリサイズ
-    height, width, channels = image.shape
-    new_height = height + tmargin + bmargin
-    new_width = width + lmargin + rmargin
-    new_image = np.zeros((new_height, new_width, channels), dtype=image.dtype)
-    new_image[:, :] = color
-    new_image[tmargin:tmargin + height, lmargin:lmargin + width] = image
-    return new_image
-
-def main():
     dpi = 96  # DPIを指定
     dpi2 = 300  # DPIを指定
     ext = '.png'  # 対象の拡張子を指定
@@ -90,23 +34,26 @@ def main():
     scale = dpi2 / dpi  # 拡大率を計算
     xmargin = 10  # キャンバスの余白を指定
     ymargin = 10  # キャンバスの余白を指定
+    try:
+        output_format, options = encoder_settings(args)
+    except ValueError as e:
+        parser.error(str(e))
+    background = parse_background(args.background)
+    if output_format is not None:
+        output_ext = FORMATS[output_format]
 
     # ファイル一覧を取得
     dir_path = 'rgba2rgb_input'
-    files = file_list(dir_path, ext)
+    files = file_list(dir_path, ext, **scan_options(args))
 
     output_dir = 'rgba2rgb_output'
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    for f in files:
-        print('Processing:', f)
-        file_path = os.path.join(dir_path, f)
-        output_path = os.path.join(output_dir, os.path.splitext(f)[0] + output_ext)
-        image = read_image(file_path)
-        image_rgb = rgba2rgb(image)
-        save_image(output_path, image_rgb)
-        dpi_change(output_path, dpi2)
+    task = partial(process_file, dir_path=dir_path, output_dir=output_dir, dpi2=dpi2, output_ext=output_ext,
+                   options=options, background=background)
+    params = {'dpi2': dpi2, 'output_ext': output_ext, 'encoder': options, 'background': background}
+    return run_files(task, files, dir_path, output_dir, params, args)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file